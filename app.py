@@ -1,14 +1,20 @@
-import pandas as pd
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, make_response, stream_with_context
 from flask_cors import CORS
 
 from src.analyzer import Analyzer
 from src.dataloader import DataLoader
 from src.helper import Helper
+from src.live import LiveActivity
+from src.pipeline import MetricsPipeline
+from src.response_cache import ResponseCache, etag
+from src.task_pile import TaskPileRefresher
+from src.timings import StageHistograms
 from datetime import datetime, timedelta
 from src.constants import TIME_MAP
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import os
+import hmac
 import pytz
 
 
@@ -23,6 +29,74 @@ CORS(app)
 historical_view = False
 timezone = "America/New_York"
 
+# Built once per worker: the loader/analyzer hold the pooled database engine,
+# the Google credentials and the calendar clients, which are reused by every
+# request instead of being rebuilt on each dashboard refresh.
+l = DataLoader()
+a = Analyzer()
+
+# The Toggl, Calendar and Postgres calls of a request are independent, so they are
+# issued side by side on this pool and joined before the analysis step.
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("FANOUT_WORKERS", 16)))
+
+# /metricsdate responses, ranges that ended before today are kept until evicted
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", 256)),
+    live_ttl=int(os.getenv("RESPONSE_CACHE_LIVE_TTL", 60)),
+)
+
+# Durations of the pipeline stages, served by /metrics-internal
+stage_histograms = StageHistograms()
+
+# The task pile is recomputed in the background, /metrics reads the last value
+task_pile = TaskPileRefresher(
+    a,
+    interval=int(os.getenv("TASK_PILE_INTERVAL", 300)),
+    poll_interval=int(os.getenv("TASK_PILE_POLL_INTERVAL", 60)),
+    histograms=stage_histograms,
+)
+
+# Pushes the current activity and flow to every /live client from a single Toggl poller
+live_activity = LiveActivity(
+    l,
+    a,
+    timezone=timezone,
+    poll_interval=int(os.getenv("LIVE_POLL_INTERVAL", 10)),
+    tail_ttl=int(os.getenv("LIVE_TAIL_TTL", 300)),
+    # Each /live client holds one of the GUNICORN_THREADS threads while connected
+    max_subscribers=int(os.getenv("LIVE_MAX_SUBSCRIBERS", 8)),
+)
+
+def start_background_work():
+    """
+    Starts the threads of this worker. Gunicorn preloads the app in the master and forks the
+    workers from it, threads started at import would stay in the master, so each worker starts
+    its own from the post_fork hook in gunicorn.conf.py. That hook is the only caller under
+    gunicorn, any other server has to call this once in every process serving requests (the
+    development server below does).
+    """
+    task_pile.start()
+    # Distraction counts are read from rollups this thread keeps up to date
+    if a.database_url:
+        a.keystrokes.start()
+
+
+def current_activity(current_task, last_run_start):
+    """
+    Project and start of the current Toggl task, the start of the last run of the range when
+    there is no task
+    """
+    if current_task.empty:
+        return {
+            "currentActivity": TIME_MAP["No Activity"],
+            "currentActivityStartTime": last_run_start,
+        }
+    return {
+        "currentActivity": TIME_MAP[current_task.iloc[0]["Project"]],
+        "currentActivityStartTime": current_task.iloc[0]["Start"].isoformat(),
+    }
+
+
 @app.route("/")
 def hello_world():
     return "Hello, World!"
@@ -30,33 +104,11 @@ def hello_world():
 
 @app.route("/metricsdate")
 def metricsdate():
-
-    l = DataLoader()
-    a = Analyzer()
     start_date = request.args.get("startDate")
     end_date = request.args.get("endDate")
 
     print("start date", start_date, "end date", end_date)
 
-    current_task = l.get_toggl_current_task()
-    current_activity = (
-        current_task.iloc[0]["Project"] if not current_task.empty else "No Activity"
-    )
-
-    now_df = pd.DataFrame(
-        columns=[
-            "Id",
-            "Project",
-            "Description",
-            "Start date",
-            "Start time",
-            "End date",
-            "End time",
-            "Tags",
-            "SecDuration",
-        ]
-    )
-    
     start_datetime = datetime.strptime(start_date, "%Y-%m-%d")
     end_datetime = datetime.strptime(end_date, "%Y-%m-%d")
 
@@ -64,73 +116,104 @@ def metricsdate():
     end_datetime = end_datetime.replace(hour=23, minute=59, second=59, microsecond=0)
     
     start_date, end_date = str(start_datetime)[:10], str(end_datetime)[:10]
-    time_df = l.fetch_data(start_date, end_date, timezone=timezone)
-    
-    master_df = pd.concat([time_df, now_df]).reset_index(drop=True)
-    master_df["TagProductive"] = master_df["Tags"].str.contains("Productive")
-    master_df["TagUnavoidable"] = master_df["Tags"].str.contains("Unavoidable")
-    master_df["Carryover"] = master_df["Tags"].str.contains("Carryover")
-    master_df["FlowExempt"] = master_df["Tags"].str.contains("FlowExempt")
-
-    flow_df = a.group_df(master_df)
-    flow = (
-        round(flow_df.iloc[-1]["SecDuration"] / 3600, 3) if not historical_view else 0
-    )
-    master_df = master_df.drop(
-        columns=["TagProductive", "TagUnavoidable", "Carryover", "FlowExempt"], axis=1
-    )
-    unplanned_time = a.calculate_unplanned_time(start_date, end_date, week=True)
-    p1HUT, n1HUT, nw1HUT, w1HUT = a.calculate_1HUT(master_df, week=True).values()
-    hours_free, efficiency, inefficiency, productive, neutral, wasted, non_wasted = (
-        a.efficiency(l, master_df, week=True).values()
-    )
-    oneHUT = {
-        date: round(
-            n1HUT.get(date, 0)
-            + nw1HUT.get(date, 0)
-            + p1HUT.get(date, 0)
-            + w1HUT.get(date, 0),
-            3,
+
+    ## A range that ended before today only changes when its stored days are invalidated
+    today = str(datetime.now(pytz.timezone(timezone)))[:10]
+    closed = end_date < today
+    version = l.rollup.version()
+    cache_key = (start_date, end_date, timezone, version)
+
+    cached = response_cache.get(cache_key)
+    server_timing = None
+    current_task = None
+    if cached is None:
+        pipeline = MetricsPipeline(l, a, executor, timezone=timezone)
+        return_object = pipeline.run(start_date, end_date, historical=historical_view)
+        stage_histograms.observe_timer(pipeline.timer)
+        server_timing = pipeline.timer.header()
+        current_task = pipeline.current_task
+
+        pretty_json = json.dumps(return_object, indent=4)
+        print(pretty_json)
+        cached = response_cache.put(
+            cache_key, (return_object, pipeline.last_run_start), closed
         )
-        for date in n1HUT
-    }
 
-    distraction_counts = a.calculate_distraction_counts(start_date, end_date, week=True)
-
-    return_object = {
-        "unplannedTimeList": unplanned_time,
-        "totalFlowList": oneHUT,
-        "productiveFlowList": p1HUT,
-        "n1HUTList": n1HUT,
-        "nw1HUTList": nw1HUT,
-        "w1HUTList": w1HUT,
-        "unproductiveList": wasted,
-        "hoursFreeList": hours_free,
-        "efficiencyList": efficiency,
-        "productiveList": productive,
-        "distractionCountList": distraction_counts,
-        "inefficiencyList": inefficiency,
-        "flow": flow,
-        "startDate": start_date,
-        "endDate": end_date,
-        "currentActivity": TIME_MAP[current_activity],
-        "currentActivityStartTime": pd.Timestamp(f"{flow_df.iloc[-1]['Start date']} {flow_df.iloc[-1]['Start time']}").tz_localize(timezone).isoformat(),
-    }
+    ## The current activity is never cached
+    return_object, last_run_start = cached
+    if current_task is None:
+        current_task = l.get_toggl_current_task(timezone=timezone)
+    body = app.json.dumps(
+        {"status": 200, "data": {**return_object, **current_activity(current_task, last_run_start)}}
+    )
+    response = make_response(body)
+    response.mimetype = "application/json"
+    response.set_etag(etag(body, version))
+    response.headers["Cache-Control"] = "private, no-cache"
+    if server_timing:
+        response.headers["Server-Timing"] = server_timing
+    # Answers 304 Not Modified when the If-None-Match header carries the same ETag
+    return response.make_conditional(request)
+
+
 
-    pretty_json = json.dumps(return_object, indent=4)
-    print(pretty_json)
-    return {"status": 200, "data": return_object}
 
+@app.route("/current")
+def current():
+    return {"status": 200, "data": live_activity.current()}
 
 
+@app.route("/live")
+def live():
+    subscriber = live_activity.subscribe()
+    if subscriber is None:
+        return {"status": 503, "error": "too many live clients"}, 503, {"Retry-After": "30"}
+    response = Response(
+        stream_with_context(live_activity.stream(subscriber)), mimetype="text/event-stream"
+    )
+    # Also runs when the client leaves before the stream started
+    response.call_on_close(lambda: live_activity.unsubscribe(subscriber))
+    response.headers["Cache-Control"] = "no-cache"
+    # Stops nginx style proxies from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.route("/keystrokes", methods=["POST"])
+def keystrokes():
+    ## Producers authenticate with a bearer token, nothing is accepted until INGEST_TOKEN is set
+    token = os.getenv("INGEST_TOKEN")
+    if not token:
+        return {"status": 503, "error": "ingest is not configured"}, 503
+    if not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return {"status": 401, "error": "invalid token"}, 401
+
+    body = request.get_json(silent=True)
+    events = body.get("events") if isinstance(body, dict) else body
+    if not isinstance(events, list):
+        return {"status": 400, "error": "expected a list of events"}, 400
+    if len(events) > int(os.getenv("INGEST_MAX_EVENTS", 10000)):
+        return {"status": 413, "error": "too many events"}, 413
+
+    try:
+        times = a.keystrokes.ingest(events)
+    except (KeyError, TypeError, ValueError) as error:
+        return {"status": 400, "error": f"invalid event: {error}"}, 400
+
+    ## The distraction counts of these days changed, the rollup holds only Toggl metrics so its
+    ## days stay, the version moves on so no worker serves a response cached before the insert
+    l.rollup.bump_version()
+    response_cache.invalidate({str(time.tz_convert(timezone))[:10] for time in times})
+    return {"status": 200, "data": {"received": len(events), "inserted": len(times)}}
+
 
 @app.route("/metrics")
 def metrics():
     # response = jsonify({"message": "Data from Python serveOr"})
     # response.headers.add("Access-Control-Allow-Origin", "*")
     ## Getting Toggl & Calendar Data
-    l = DataLoader()
-    a = Analyzer()
 
     personal = request.args.get("personal")
 
@@ -138,32 +221,13 @@ def metrics():
     est = pytz.timezone(timezone)
     now = now_utc.astimezone(est)
 
-    current_task = l.get_toggl_current_task(timezone=timezone)
-    current_activity = (
-        current_task.iloc[0]["Project"] if not current_task.empty else "No Activity"
-    )
-
     if historical_view:
-        now_df = pd.DataFrame(
-            columns=[
-                "Id",
-                "Project",
-                "Description",
-                "Start date", 
-                "Start time",
-                "End date",
-                "End time",
-                "Tags",
-                "SecDuration",
-            ]
-        )
         start_date, end_date = "2024-06-17", "2024-06-23"
         start_date, end_date = a.prev_week(start_date, end_date, times=0)
         # print("start date", start_date, "end date", end_date)
         start_datetime = datetime.strptime(start_date, "%Y-%m-%d")
         end_datetime = datetime.strptime(end_date, "%Y-%m-%d")
     else:
-        now_df = current_task
         if personal == "true":
             ## set start and end date to the beginning and current time of the week
             start_datetime, end_datetime = now - timedelta(days=now.weekday()), now
@@ -175,66 +239,53 @@ def metrics():
     end_datetime = end_datetime.replace(hour=23, minute=59, second=59, microsecond=0)
     
     start_date, end_date = str(start_datetime)[:10], str(end_datetime)[:10]
-    time_df = l.fetch_data(start_date, end_date, timezone=timezone)
-    master_df = pd.concat([time_df, now_df]).reset_index(drop=True)
-    master_df["TagProductive"] = master_df["Tags"].str.contains("Productive")
-    master_df["TagUnavoidable"] = master_df["Tags"].str.contains("Unavoidable")
-    master_df["Carryover"] = master_df["Tags"].str.contains("Carryover")
-    master_df["FlowExempt"] = master_df["Tags"].str.contains("FlowExempt")
-
-    real_df = a.simple_group_df(master_df)
-    flow_df = a.group_df(master_df)
-    flow = (
-        round(flow_df.iloc[-1]["SecDuration"] / 3600, 3) if not historical_view else 0
-    )
-    master_df = master_df.drop(
-        columns=["TagProductive", "TagUnavoidable", "Carryover", "FlowExempt"], axis=1
+
+    pipeline = MetricsPipeline(l, a, executor, timezone=timezone)
+    return_object = pipeline.run(
+        start_date,
+        end_date,
+        include_current=not historical_view,
+        task_pile=task_pile,
+        historical=historical_view,
     )
-    unplanned_time = a.calculate_unplanned_time(start_date, end_date, week=True)
-    task_pile = a.calculate_task_pile()
-    p1HUT, n1HUT, nw1HUT, w1HUT = a.calculate_1HUT(master_df, week=True).values()
-    hours_free, efficiency, inefficiency, productive, neutral, wasted, non_wasted = (
-        a.efficiency(l, master_df, week=True).values()
+    stage_histograms.observe_timer(pipeline.timer)
+    real_df = a.simple_group_df(pipeline.master_df)
+    return_object.update(
+        {
+            "neutralActivity": pipeline.current_activity in a.neutral,
+            "currentActivity": TIME_MAP[pipeline.current_activity],
+            "currentActivityStartTime": (
+                real_df.iloc[-1]["Start"].isoformat()
+                if not real_df.empty
+                else pipeline.last_run_start
+            ),
+        }
     )
-    oneHUT = {
-        date: round(
-            n1HUT.get(date, 0)
-            + nw1HUT.get(date, 0)
-            + p1HUT.get(date, 0)
-            + w1HUT.get(date, 0),
-            3,
-        )
-        for date in n1HUT
-    }
-
-    distraction_counts = a.calculate_distraction_counts(start_date, end_date, week=True)
-
-    return_object = {
-        "unplannedTimeList": unplanned_time,
-        "totalFlowList": oneHUT,
-        "productiveFlowList": p1HUT,
-        "n1HUTList": n1HUT,
-        "nw1HUTList": nw1HUT,
-        "w1HUTList": w1HUT,
-        "unproductiveList": wasted,
-        "hoursFreeList": hours_free,
-        "efficiencyList": efficiency,
-        "productiveList": productive,
-        "distractionCountList": distraction_counts,
-        "inefficiencyList": inefficiency,
-        "flow": flow,
-        "taskPile": task_pile,
-        "startDate": start_date,
-        "endDate": end_date,
-        "neutralActivity": current_activity in a.neutral,
-        "currentActivity": TIME_MAP[current_activity],
-        "currentActivityStartTime": pd.Timestamp(f"{real_df.iloc[-1]['Start date']} {real_df.iloc[-1]['Start time']}").tz_localize(timezone).isoformat(),
-    }
 
     pretty_json = json.dumps(return_object, indent=4)
     print(pretty_json)
-    return {"status": 200, "data": return_object}
+    response = make_response({"status": 200, "data": return_object})
+    response.headers["Server-Timing"] = pipeline.timer.header()
+    return response
+
+
+@app.route("/metrics-internal")
+def metrics_internal():
+    ## Scrapers authenticate with a bearer token, nothing is served until METRICS_INTERNAL_TOKEN
+    ## is set
+    token = os.getenv("METRICS_INTERNAL_TOKEN")
+    if not token:
+        return {"status": 503, "error": "metrics are not configured"}, 503
+    if not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return {"status": 401, "error": "invalid token"}, 401
+
+    return Response(stage_histograms.render(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
+    # The reloader serves the requests from a child process, the threads belong there
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_work()
     app.run(debug=True, port=3002)
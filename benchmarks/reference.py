@@ -0,0 +1,513 @@
+"""
+The analyzer as it was before its hot paths were vectorized, for checking that the fast paths
+return the same results.
+
+The methods of BaselineAnalyzer are copied unchanged from src/analyzer.py at commit 0bdb353
+(`git show 0bdb353:src/analyzer.py`), only the class around them is new. They read the columns
+the time data had then ("Start date" and "Start time" strings, tags matched by substring), the
+functions at the bottom convert the current frames to and from that layout.
+"""
+import pandas as pd
+
+
+class BaselineAnalyzer:
+    """Baseline analysis methods, on the project lists of a current Analyzer"""
+
+    def __init__(self, analyzer):
+        self.productive = analyzer.productive
+        self.neutral = analyzer.neutral
+        self.wasted = analyzer.wasted
+        self.debug = False
+
+    # ---- copied from src/analyzer.py at 0bdb353 ----
+
+    def max_mindful_slow(self, data):
+        mindful_whitelist = ["Sleep", "Concentration", "Under Influence"]
+        slow_whitelist = [
+            "Concentration",
+            "Crypto",
+            "Deciding",
+            "Formal Learning",
+            "Gaming",
+            "General Learning",
+            "Contemplating",
+            "Meditating",
+            "Movie",
+            "Music",
+            "News",
+            "Podcast",
+            "Reflecting",
+            "Researching",
+            "Skill Learning",
+            "Social Media",
+            "Sleep",
+            "Sports",
+            "Thinking",
+            "Transportation",
+            "TV Show",
+            "Under Influence",
+            "Recalling",
+            "YouTube",
+        ]
+
+        week_summary = data[["Project", "SecDuration"]].groupby(by="Project").sum()
+
+        max_mindful = 0
+        max_slow = 0
+
+        dftag = data[["Project", "SecDuration", "Tags"]].set_index("Tags")
+        dfslow = (
+            dftag[dftag.index.str.contains("Exclude Slow")].groupby("Project").sum()
+        )
+
+        # Calculating total possible mindful seconds
+        for project, seconds in zip(
+            week_summary.index, week_summary["SecDuration"].values
+        ):
+            if project not in mindful_whitelist:
+                max_mindful += seconds
+
+        # Calculating total possible slow seconds
+        for project, seconds in zip(
+            week_summary.index, week_summary["SecDuration"].values
+        ):
+            if project not in slow_whitelist:
+                max_slow += seconds
+            if project in dfslow.index:
+                excluded_seconds = dfslow.loc[project, "SecDuration"]
+                max_slow -= excluded_seconds
+
+        return round(max_mindful / 3600, 2), round(max_slow / 3600, 2)
+
+    def simple_group_df(self, time_df):
+        # Create a DataFrame
+        df = pd.DataFrame(
+            time_df,
+            columns=[
+                "Id",
+                "Start date",
+                "Start time",
+                "Project",
+                "Description",
+                "SecDuration",
+            ],
+        )
+
+        # Create a new column 'ProjectShifted' to detect consecutive projects
+        df["ProjectShifted"] = df["Project"].shift()
+
+        # Create a 'Group' column to assign a unique group ID for consecutive projects
+        df["Group"] = (df["Project"] != df["ProjectShifted"]).cumsum()
+
+        # Group by the 'Group' column and aggregate the 'SecDuration' using sum()
+        # Also, take the first value of 'Project', 'Start date', 'Start time', and 'Description' for each group
+        grouped = df.groupby("Group").agg(
+            {
+                "Start date": "first",
+                "Start time": "first",
+                "Project": "first",
+                "Description": "first",
+                "SecDuration": "sum",
+            }
+        )
+
+        # Reset the index to flatten the grouped data
+        grouped.reset_index(drop=True, inplace=True)
+
+        # Return the grouped DataFrame
+        return grouped
+
+    def group_df(self, time_df):
+        # Create a DataFrame
+        df = pd.DataFrame(
+            time_df,
+            columns=[
+                "Id",
+                "Start date",
+                "Start time",
+                "Project",
+                "Description",
+                "SecDuration",
+                "TagProductive",
+                "TagUnavoidable",
+                "TagUnproductive",
+                "Carryover",
+                "FlowExempt",
+            ],
+        )
+
+        # Remove all Time entries that have ["Tracking", "Planning", "Eating", "Getting Ready", "Washroom"] , in the Project column and ALSO are under 100 seconds in SecDuration column
+        # df = df[~((df['Project'].isin(["Tracking", "Planning", "Eating", "Getting Ready", "Washroom", "Messaging", "Calling", "Maintenance", "People", "Relationship", "Analyzing", "Emailing", "Listening", "Organizing", "Thinking", "Food Prep/Clean/Order", "Recalling", "Unavoidable Intermission", "Technicalities"])) & (df['SecDuration'] < 100))]
+
+        df = df[~df["FlowExempt"]]
+
+        df["TagProductive"] = df["TagProductive"].astype(bool)
+        df["TagUnproductive"] = df["TagUnproductive"].astype(bool)
+        df["TagUnavoidable"] = df["TagUnavoidable"].astype(bool)
+
+        # Mark Projects that are in self.productive as 'Productive'
+        df["TagProductive"] = (
+            (df["Project"].isin(self.productive) | df["TagProductive"])
+            & ~df["TagUnproductive"]
+            & ~df["TagUnavoidable"]
+        )
+        df["TagProductiveCheck"] = df["TagProductive"]
+        df["ProjectTag"] = (
+            df["Project"]
+            + " "
+            + df["TagProductive"].astype(str)
+            + " "
+            + df["TagUnavoidable"].astype(str)
+            + " "
+            + df["TagUnproductive"].astype(str)
+        )
+        df["Shifted ProjectTag"] = df["ProjectTag"].shift()
+        shifted_carryover = df["Carryover"].shift(-1).fillna(False)
+        df["Carryover"] = df["Carryover"] | shifted_carryover
+        df["Shifted Carryover"] = df["Carryover"].shift()
+        df["PreGroup"] = ~(
+            (df["ProjectTag"] == df["ProjectTag"].shift())
+            | (df["Carryover"] & df["Carryover"].shift())
+        )
+        df["Group"] = (
+            ~(
+                (df["ProjectTag"] == df["ProjectTag"].shift())
+                | (df["Carryover"] & df["Carryover"].shift())
+            )
+        ).cumsum()
+
+        # Group by the 'Group' column, and aggregate the 'SecDuration' using sum()
+        # Also, take the first value of 'Project' for each group
+        grouped = df.groupby("Group").agg(
+            {
+                "Start date": "first",
+                "Start time": "first",
+                "Project": "first",
+                "SecDuration": "sum",
+                "TagProductive": "all",
+                "TagProductiveCheck": "any",
+                "TagUnavoidable": "all",
+                "TagUnproductive": "all",
+            }
+        )
+
+        # Update the 'Description' based on whether the group contains more than one row
+        grouped["Description"] = grouped.apply(
+            lambda row: (
+                "General"
+                if len(df[df["Group"] == row.name]) > 1
+                else df[df["Group"] == row.name].iloc[0]["Description"]
+            ),
+            axis=1,
+        )
+
+        if not grouped["TagProductive"].equals(grouped["TagProductiveCheck"]):
+            dfPrint = grouped[
+                ~grouped["TagProductive"].eq(grouped["TagProductiveCheck"])
+            ]
+            print(dfPrint[["Start date", "Start time", "Project"]])
+            raise ValueError(
+                "ERROR: TagProductive and TagProductiveCheck are not the same"
+            )
+
+        # Reset the index
+        grouped.reset_index(drop=True, inplace=True)
+        grouped = grouped[
+            [
+                "Start date",
+                "Start time",
+                "Project",
+                "Description",
+                "SecDuration",
+                "TagProductive",
+                "TagUnavoidable",
+                "TagUnproductive",
+            ]
+        ]
+        return grouped
+
+    def calculate_1HUT(self, time_df, week=False):
+        # display(Markdown("## p1HUT: Productive >1H Uninterrupted Time"))
+        flow_threshold = 50
+        daily_totals = {}
+        p1HUT_dict, n1HUT_dict, nw1HUT_dict, w1HUT_dict = {}, {}, {}, {}
+
+        time_df["TagProductive"] = time_df["Tags"].str.contains("Productive")
+        time_df["TagUnproductive"] = time_df["Tags"].str.contains("Unproductive")
+        time_df["TagUnavoidable"] = time_df["Tags"].str.contains("Unavoidable")
+        time_df["Carryover"] = time_df["Tags"].str.contains("Carryover")
+        time_df["FlowExempt"] = time_df["Tags"].str.contains("FlowExempt")
+
+        productive = self.productive
+        wasted = self.wasted
+        neutral = self.neutral
+
+        time_df = self.group_df(time_df)
+        for index in time_df.index:
+            task_seconds = int(time_df.loc[index, "SecDuration"])
+            project = time_df.loc[index, "Project"]
+            task_date = time_df.at[index, "Start date"]  # Assuming 'Date' column exists
+            tag_productive, tag_unavoidable, tag_unproductive = (
+                time_df.at[index, "TagProductive"],
+                time_df.at[index, "TagUnavoidable"],
+                time_df.at[index, "TagUnproductive"],
+            )
+            if task_date not in daily_totals:
+                daily_totals[task_date] = {
+                    "productive": 0,
+                    "neutral": 0,
+                    "non_wasted": 0,
+                    "wasted": 0,
+                }
+
+            neg_dic = ["Sleep"]
+            if task_seconds > 60 * flow_threshold and project not in neg_dic:
+                # print(
+                #     task_date,
+                #     project,
+                #     time_df.loc[index, "Start time"],
+                #     time_df.loc[index, "Description"][:30],
+                #     task_seconds / 3600,
+                # )
+                # print(tag_productive, tag_unavoidable)
+                if project in productive:
+                    if tag_unavoidable:
+                        daily_totals[task_date]["neutral"] += task_seconds
+                    elif tag_unproductive:
+                        daily_totals[task_date]["non_wasted"] += task_seconds
+                        if task_seconds / 3600 > wasted[project]:
+                            # print(task_date, project, task_seconds/3600, wasted[project])
+                            daily_totals[task_date]["wasted"] += (
+                                task_seconds - wasted[project] * 3600
+                            )
+                    elif tag_productive:
+                        daily_totals[task_date]["productive"] += task_seconds
+                    else:
+                        print("PLEASE TAG YOUR CARRYOVER TASKS PROPERLY")
+                        print(
+                            task_date,
+                            time_df.loc[index, "Start time"],
+                            project,
+                            time_df.loc[index, "Description"][:10],
+                            task_seconds / 3600,
+                        )
+                        raise ValueError("PLEASE TAG YOUR CARRYOVER TASKS PROPERLY")
+                elif project in neutral:
+                    if tag_productive:
+                        daily_totals[task_date]["productive"] += task_seconds
+                    elif tag_unproductive:
+                        daily_totals[task_date]["non_wasted"] += task_seconds
+                        if task_seconds / 3600 > wasted[project]:
+                            # print(task_date, project, task_seconds/3600, wasted[project])
+                            daily_totals[task_date]["wasted"] += (
+                                task_seconds - wasted[project] * 3600
+                            )
+                    else:
+                        daily_totals[task_date]["neutral"] += task_seconds
+                elif project in wasted:
+                    if tag_productive:
+                        daily_totals[task_date]["productive"] += task_seconds
+                    elif tag_unavoidable:
+                        daily_totals[task_date]["neutral"] += task_seconds
+                    else:
+                        if task_seconds / 3600 > wasted[project]:
+                            # print(task_date, project, task_seconds/3600, wasted[project])
+                            daily_totals[task_date]["non_wasted"] += wasted[project] * 3600
+                            daily_totals[task_date]["wasted"] += (
+                                task_seconds - wasted[project] * 3600
+                            )
+                        else:
+                            daily_totals[task_date]["non_wasted"] += task_seconds
+                            
+        if week:
+            for date in sorted(daily_totals.keys()):
+                day_data = daily_totals[date]
+                p1HUT_dict[date] = round(day_data["productive"] / 3600, 3)
+                n1HUT_dict[date] = round(day_data["neutral"] / 3600, 3)
+                nw1HUT_dict[date] = round(day_data["non_wasted"] / 3600, 3)
+                w1HUT_dict[date] = round(day_data["wasted"] / 3600, 3)
+
+            return {
+                "p1HUT": p1HUT_dict,
+                "n1HUT": n1HUT_dict,
+                "nw1HUT": nw1HUT_dict,
+                "w1HUT": w1HUT_dict,
+            }
+
+        else:
+            # Calculate total duration for each category across the entire date range
+            total_productive = sum(
+                daily_totals[date]["productive"] for date in daily_totals
+            )
+            total_neutral = sum(daily_totals[date]["neutral"] for date in daily_totals)
+            total_non_wasted = sum(
+                daily_totals[date]["non_wasted"] for date in daily_totals
+            )
+            total_wasted = sum(daily_totals[date]["wasted"] for date in daily_totals)
+
+            # Convert to hours and round
+            p1HUT = round(total_productive / 3600, 3)
+            n1HUT = round(total_neutral / 3600, 3)
+            nw1HUT = round(total_non_wasted / 3600, 3)
+            w1HUT = round(total_wasted / 3600, 3)
+
+            # Count the number of days in which each category occurred
+            Np1HUT = sum(
+                1 for date in daily_totals if daily_totals[date]["productive"] > 0
+            )
+            Nn1HUT = sum(
+                1 for date in daily_totals if daily_totals[date]["neutral"] > 0
+            )
+            Nnw1HUT = sum(
+                1 for date in daily_totals if daily_totals[date]["non_wasted"] > 0
+            )
+            Nw1HUT = sum(1 for date in daily_totals if daily_totals[date]["wasted"] > 0)
+
+            # Return the total duration for each category
+            return {
+                "p1HUT": p1HUT,
+                "n1HUT": n1HUT,
+                "nw1HUT": nw1HUT,
+                "w1HUT": w1HUT,
+                "Np1HUT": Np1HUT,
+                "Nn1HUT": Nn1HUT,
+                "Nnw1HUT": Nnw1HUT,
+                "Nw1HUT": Nw1HUT,
+            }
+
+    def efficiency(self, loader, data, debug=False, week=False):
+        self.debug = debug
+        productive = self.productive
+        wasted = self.wasted
+        neutral = self.neutral
+
+        data["TagProductive"] = data["Tags"].str.contains("Productive")
+        data["TagUnavoidable"] = data["Tags"].str.contains("Unavoidable")
+        data["SecDuration"] = data["SecDuration"].astype(int)
+        grouped_data = (
+            data.groupby(["Start date", "Project", "TagProductive", "TagUnavoidable"])
+            .sum(numeric_only=True)
+            .reset_index()
+        )
+
+        # Initializing total and daily metrics
+        daily_metrics = {
+            "hours_free": {},
+            "efficiency": {},
+            "inefficiency": {},
+            "productive": {},
+            "neutral": {},
+            "wasted": {},
+            "non_wasted": {},
+        }
+
+        # Processing each day and project
+        for date, group in grouped_data.groupby("Start date"):
+            day_totals = {key: 0 for key in daily_metrics.keys()}
+            for _, row in group.iterrows():
+                project, seconds = row["Project"], row["SecDuration"]
+                tag_productive, tag_unavoidable = (
+                    row["TagProductive"],
+                    row["TagUnavoidable"],
+                )
+                day_totals["hours_free"] += seconds
+
+                if project in neutral:
+                    if tag_productive:
+                        productive_seconds = seconds
+                        day_totals["productive"] += productive_seconds
+                    else:
+                        day_totals["hours_free"] -= seconds
+                        day_totals["neutral"] += seconds
+                elif project in productive:
+                    day_totals["productive"] += seconds
+                    if tag_unavoidable:
+                        neutral_seconds = seconds
+                        day_totals["neutral"] += neutral_seconds
+                        day_totals["hours_free"] -= neutral_seconds
+                elif project in wasted.keys():
+                    wasted_seconds = seconds  # 3600
+                    if tag_productive:
+                        productive_seconds = seconds
+                        wasted_seconds -= productive_seconds
+                        day_totals["productive"] += productive_seconds
+                    elif tag_unavoidable:
+                        neutral_seconds = seconds
+                        wasted_seconds -= neutral_seconds
+                        day_totals["neutral"] += neutral_seconds
+                        day_totals["hours_free"] -= neutral_seconds
+                    non_wasted_seconds = min(wasted_seconds, wasted[project] * 3600)
+                    day_totals["non_wasted"] += non_wasted_seconds
+                    day_totals["wasted"] += wasted_seconds - non_wasted_seconds
+
+            for metric, value in day_totals.items():
+                daily_metrics[metric][str(date)[:10]] = round(value / 3600, 3)
+
+        # Calculating hours free and efficiency for each day and adding to daily_metrics
+        for date in daily_metrics["hours_free"]:
+            if (daily_metrics["hours_free"][date]) != 0:
+                daily_metrics["efficiency"][date] = round(
+                    daily_metrics["productive"][date]
+                    / daily_metrics["hours_free"][date],
+                    4,
+                )
+                daily_metrics["inefficiency"][date] = round(
+                    daily_metrics["wasted"][date] / daily_metrics["hours_free"][date], 4
+                )
+
+        if week:
+            return daily_metrics
+        else:
+            return {
+                metric: round(sum(daily_metrics[metric].values()), 4)
+                for metric in daily_metrics
+            }
+
+    # ---- end of the copy ----
+
+
+def to_baseline(df):
+    """
+    The frame with the baseline layout: "Start" becomes the "Start date" and "Start time"
+    strings in its place, projects are plain strings and the columns the baseline never had are
+    dropped
+    """
+    df = df.drop(columns=[column for column in ("End", "TagFlags") if column in df])
+    position = df.columns.get_loc("Start")
+    df.insert(position, "Start date", df["Start"].dt.strftime("%Y-%m-%d"))
+    df.insert(position + 1, "Start time", df["Start"].dt.strftime("%H:%M:%S"))
+    return df.drop(columns="Start").astype({"Project": str})
+
+
+def with_tag_columns(time_df):
+    """The tag columns the baseline calculate_1HUT adds before calling group_df"""
+    time_df = time_df.copy()
+    for column, tag in (
+        ("TagProductive", "Productive"),
+        ("TagUnproductive", "Unproductive"),
+        ("TagUnavoidable", "Unavoidable"),
+        ("Carryover", "Carryover"),
+        ("FlowExempt", "FlowExempt"),
+    ):
+        time_df[column] = time_df["Tags"].str.contains(tag)
+    return time_df
+
+
+def simple_group_df(analyzer, time_df):
+    return BaselineAnalyzer(analyzer).simple_group_df(to_baseline(time_df))
+
+
+def group_df(analyzer, time_df):
+    return BaselineAnalyzer(analyzer).group_df(with_tag_columns(to_baseline(time_df)))
+
+
+def calculate_1HUT(analyzer, time_df):
+    return BaselineAnalyzer(analyzer).calculate_1HUT(to_baseline(time_df), week=True)
+
+
+def efficiency(analyzer, data):
+    return BaselineAnalyzer(analyzer).efficiency(None, to_baseline(data), week=True)
+
+
+def max_mindful_slow(analyzer, data):
+    return BaselineAnalyzer(analyzer).max_mindful_slow(to_baseline(data))
@@ -0,0 +1,122 @@
+"""
+Benchmarks of the analyzer's hot paths on synthetic entries.
+
+    python -m benchmarks.run [--sizes 1000 10000 100000 1000000] [--check]
+
+Every path is timed on frames of each size (best of --repeat runs). With --check, the results of
+the vectorized paths are compared with the baseline analyzer copied into benchmarks/reference.py,
+for sizes up to --check-max-size (the baseline group_df is quadratic), and the run fails on a
+difference.
+Nothing leaves the machine, the Analyzer is built with placeholder Google credentials when
+none are set.
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+from benchmarks import reference
+from benchmarks.synthetic import generate_entries
+from src.analyzer import Analyzer
+from src.helper import Helper as helper
+
+GOOGLE_APP_VARIABLES = [
+    "GOOGLE_APP_TYPE",
+    "GOOGLE_APP_PROJECT_ID",
+    "GOOGLE_APP_PRIVATE_KEY_ID",
+    "GOOGLE_APP_PRIVATE_KEY",
+    "GOOGLE_APP_CLIENT_EMAIL",
+    "GOOGLE_APP_CLIENT_ID",
+    "GOOGLE_APP_AUTH_URI",
+    "GOOGLE_APP_TOKEN_URI",
+    "GOOGLE_APP_AUTH_PROVIDER_X509_CERT_URL",
+    "GOOGLE_APP_CLIENT_X509_CERT_URL",
+    "GOOGLE_APP_UNIVERSE_DOMAIN",
+]
+
+
+def paths(analyzer):
+    """name -> (function of the entries, entry by entry reference or None)"""
+    return {
+        "group_df": (
+            analyzer.group_df,
+            lambda df: reference.group_df(analyzer, df),
+        ),
+        "simple_group_df": (
+            analyzer.simple_group_df,
+            lambda df: reference.simple_group_df(analyzer, df),
+        ),
+        "calculate_1HUT": (
+            lambda df: analyzer.calculate_1HUT(df, week=True),
+            lambda df: reference.calculate_1HUT(analyzer, df),
+        ),
+        "efficiency": (
+            lambda df: analyzer.efficiency(None, df, week=True),
+            lambda df: reference.efficiency(analyzer, df),
+        ),
+        "max_mindful_slow": (
+            analyzer.max_mindful_slow,
+            lambda df: reference.max_mindful_slow(analyzer, df),
+        ),
+        "sum_tags_hours": (lambda df: helper.sum_tags_hours(df, "Mindfulness"), None),
+    }
+
+
+def best_of(function, df, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(df)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def same(result, expected):
+    if isinstance(expected, pd.DataFrame):
+        ## Start times, categories and integer widths differ between the paths, the values may not
+        result = reference.to_baseline(result)
+        try:
+            pd.testing.assert_frame_equal(
+                result.reset_index(drop=True), expected, check_dtype=False
+            )
+        except AssertionError:
+            return False
+        return True
+    return result == expected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--days", type=int, default=None, help="days the entries span")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--check-max-size", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for variable in GOOGLE_APP_VARIABLES:
+        os.environ.setdefault(variable, "benchmark")
+    analyzer = Analyzer()
+    failed = []
+
+    print(f"{'entries':>9}  {'path':<18}{'time':>12}{'reference':>12}{'speedup':>9}")
+    for size in args.sizes:
+        df = generate_entries(analyzer, size, days=args.days, seed=args.seed)
+        for name, (function, slow) in paths(analyzer).items():
+            seconds, result = best_of(function, df, args.repeat if size < 1_000_000 else 1)
+            line = f"{size:>9}  {name:<18}{seconds * 1000:>9.1f} ms"
+            if args.check and slow is not None and size <= args.check_max_size:
+                reference_seconds, expected = best_of(slow, df, 1)
+                line += f"{reference_seconds * 1000:>9.1f} ms{reference_seconds / seconds:>8.1f}x"
+                if not same(result, expected):
+                    line += "  DIFFERENT"
+                    failed.append((size, name))
+            print(line, flush=True)
+
+    if failed:
+        sys.exit(f"results differ from the reference: {failed}")
@@ -0,0 +1,84 @@
+"""
+Startup time of the server.
+
+    python benchmarks/startup.py [--runs 10] [--max-seconds 1.0]
+
+`import` is a cold interpreter importing app.py, what the gunicorn master (or a worker without
+preloading) pays. `fork` is a worker forked from the preloaded app answering its first request,
+what booting or adding a worker costs. The run fails when the median worker boot takes longer
+than --max-seconds. The environment needs the same variables as the server (DATABASE_URL and
+the GOOGLE_APP_* ones). No request leaves the machine: the forked child doesn't run gunicorn's
+post_fork hook, so the task pile refresher (Google Calendar) and the keystroke rollup refresher
+(Postgres) are never started. The time entry store goes to a temporary directory, so the run
+leaves no time_entries.sqlite3 behind.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+IMPORT = """
+import time
+started = time.perf_counter()
+import app
+print(time.perf_counter() - started)
+"""
+
+FORK = """
+import os, sys, time
+import app
+
+for _ in range({runs}):
+    read, write = os.pipe()
+    started = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        app.app.test_client().get("/")
+        os.write(write, b"x")
+        os._exit(0)
+    os.read(read, 1)
+    print(time.perf_counter() - started)
+    os.waitpid(pid, 0)
+"""
+
+
+def run(code, store_dir):
+    env = {**os.environ, "TIME_ENTRY_STORE_PATH": os.path.join(store_dir, "time_entries.sqlite3")}
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    ## The app prints while it loads, the timings are the lines that parse as numbers
+    timings = []
+    for line in output.splitlines():
+        try:
+            timings.append(float(line))
+        except ValueError:
+            pass
+    return timings
+
+
+def report(name, timings):
+    print(
+        f"{name:<8} median {statistics.median(timings) * 1000:8.1f} ms"
+        f"   min {min(timings) * 1000:8.1f} ms   max {max(timings) * 1000:8.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        imports = [run(IMPORT, store_dir)[-1] for _ in range(args.runs)]
+        forks = run(FORK.format(runs=args.runs), store_dir)
+    report("import", imports)
+    report("fork", forks)
+
+    if statistics.median(forks) > args.max_seconds:
+        sys.exit(f"worker boot took longer than {args.max_seconds}s")
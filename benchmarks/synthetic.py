@@ -0,0 +1,128 @@
+"""
+Synthetic time entries in the frame `DataLoader.fetch_data` returns (same columns and dtypes), for
+benchmarking the analyzer without Toggl.
+"""
+import numpy as np
+import pandas as pd
+
+from src.helper import Helper
+
+# A day of tracking is about this many entries, used when the day count isn't given
+ENTRIES_PER_DAY = 40
+# Share of entries that continue the project of the entry before them
+REPEAT_RATE = 0.3
+
+# Probability of every tag. "Unproductive" is only put on projects that have a wasted allowance,
+# "Mindfulness" and "Slowness" get a fraction ("1/2 Mindfulness") like the real tags
+TAG_MIX = {
+    "Productive": 0.2,
+    "Unproductive": 0.1,
+    "Unavoidable": 0.05,
+    "Carryover": 0.05,
+    "FlowExempt": 0.02,
+    "Exclude Slow": 0.05,
+    "Mindfulness": 0.3,
+    "Slowness": 0.2,
+}
+FRACTIONS = ["1/4", "1/2", "3/4", "1/1"]
+FRACTIONAL_TAGS = {"Mindfulness", "Slowness"}
+
+
+def default_project_mix(analyzer):
+    """Weight of every project: most time productive or neutral, some wasted, a bit untracked"""
+    mix = {}
+    for projects, weight in (
+        (analyzer.productive, 0.45),
+        (analyzer.neutral, 0.32),
+        (list(analyzer.wasted), 0.2),
+    ):
+        for project in projects:
+            mix[project] = mix.get(project, 0) + weight / len(projects)
+    mix["No Project"] = 0.03
+    return mix
+
+
+def generate_entries(
+    analyzer,
+    entries=10_000,
+    days=None,
+    project_mix=None,
+    tag_mix=None,
+    timezone="America/New_York",
+    seed=0,
+):
+    """
+    Back to back entries ending now, the same for the same arguments.
+    :param analyzer: Analyzer whose project lists the default project mix is drawn from
+    :param entries: number of entries
+    :param days: days the entries are spread over, ENTRIES_PER_DAY per day by default
+    :param project_mix: dict of project -> weight, default_project_mix by default
+    :param tag_mix: dict of tag -> probability of an entry having it, TAG_MIX by default
+    :return: pandas dataframe, the time data
+    """
+    rng = np.random.default_rng(seed)
+    days = days or max(1, entries // ENTRIES_PER_DAY)
+    project_mix = project_mix or default_project_mix(analyzer)
+    tag_mix = TAG_MIX if tag_mix is None else tag_mix
+
+    ## Projects, with runs of the same one
+    names = list(project_mix)
+    weights = np.array([project_mix[name] for name in names], dtype=float)
+    project = rng.choice(len(names), size=entries, p=weights / weights.sum())
+    repeat = rng.random(entries) < REPEAT_RATE
+    repeat[:1] = False
+    source = np.where(repeat, 0, np.arange(entries))
+    project = project[np.maximum.accumulate(source)]
+
+    ## Durations filling the days, a quarter of the entries is longer than the flow threshold
+    durations = rng.exponential(1.0, entries)
+    durations = np.maximum(durations * days * 86400 / durations.sum(), 1).astype(np.int64)
+    end = pd.Timestamp.now(tz="UTC").floor("s").value // 10**9
+    starts = end - np.cumsum(durations[::-1])[::-1]
+    stops = starts + durations
+
+    ## Tags
+    has = {tag: rng.random(entries) < probability for tag, probability in tag_mix.items()}
+    if "Unproductive" in has:
+        allowed = np.array([name in analyzer.wasted for name in names])
+        has["Unproductive"] &= allowed[project]
+    carryover = has.pop("Carryover", np.zeros(entries, dtype=bool))
+    fractions = rng.choice(FRACTIONS, size=entries)
+    tag_lists = [
+        [
+            f"{fractions[i]} {tag}" if tag in FRACTIONAL_TAGS else tag
+            for tag in has
+            if has[tag][i]
+        ]
+        for i in range(entries)
+    ]
+    ## A carryover continues the entry before it, and marks that entry as a carryover too.
+    ## group_df links neighbouring carryovers after dropping the flow exempt entries, so a
+    ## carryover two entries after another one would also link the entry in between: skipped
+    kept = [i for i in range(entries) if "FlowExempt" not in tag_lists[i]]
+    tagged = np.zeros(len(kept), dtype=bool)
+    for position, i in enumerate(kept):
+        if not carryover[i] or position == 0:
+            continue
+        if position >= 2 and tagged[position - 2] and not tagged[position - 1]:
+            continue
+        previous = kept[position - 1]
+        tag_lists[i] = [tag for tag in tag_lists[previous] if tag != "Carryover"] + ["Carryover"]
+        project[i] = project[previous]
+        tagged[position] = True
+
+    df = pd.DataFrame(
+        {
+            "Id": np.arange(entries, dtype=np.int64) + 3_000_000_000,
+            "Project": pd.Categorical.from_codes(project, categories=names),
+            "Description": np.array(
+                [f"task {n}" for n in rng.integers(0, 500, entries)], dtype=object
+            ),
+            "Start": pd.to_datetime(starts, unit="s", utc=True).tz_convert(timezone),
+            "End": pd.to_datetime(stops, unit="s", utc=True).tz_convert(timezone),
+            "Tags": np.array([", ".join(tags) for tags in tag_lists], dtype=object),
+            "TagFlags": Helper.tag_flags(tag_lists),
+            "SecDuration": durations.astype(np.int32),
+        }
+    )
+    return df
@@ -0,0 +1,16 @@
+import os
+
+# The app (pandas, numpy, Flask and the src modules) is imported once in the master and the
+# workers are forked from it, so booting or adding a worker doesn't import anything again.
+preload_app = True
+worker_class = "gthread"
+# Every open /live stream holds a thread, at most LIVE_MAX_SUBSCRIBERS (8) per worker, the rest
+# serve the other routes. Raise both together to keep more dashboards connected
+threads = int(os.getenv("GUNICORN_THREADS", 16))
+
+
+# The only place the background threads are started under gunicorn, see start_background_work
+def post_fork(server, worker):
+    from app import start_background_work
+
+    start_background_work()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Text, DateTime
+from sqlalchemy import Column, Integer, Text, DateTime, Date, Index
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -8,3 +8,28 @@ class KeyboardShortcut(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     keyboard_shortcut = Column(Text)
     time = Column(DateTime)  # Changed from Date to DateTime
+
+    __table_args__ = (
+        Index('ix_keyboard_shortcuts_shortcut_time', 'keyboard_shortcut', 'time'),
+    )
+
+class KeyboardShortcutHourly(Base):
+    # Presses per shortcut and hour, hours are in the timezone of keyboard_shortcuts.time
+    __tablename__ = 'keyboard_shortcuts_hourly'
+    keyboard_shortcut = Column(Text, primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+class KeyboardShortcutDaily(Base):
+    # Presses per shortcut and local day of the timezone
+    __tablename__ = 'keyboard_shortcuts_daily'
+    keyboard_shortcut = Column(Text, primary_key=True)
+    timezone = Column(Text, primary_key=True)
+    day = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+class RollupState(Base):
+    # Highest keyboard_shortcuts.id already added to a rollup
+    __tablename__ = 'rollup_state'
+    name = Column(Text, primary_key=True)
+    last_id = Column(Integer, nullable=False)
@@ -1,30 +1,35 @@
 import os
+import threading
 from datetime import datetime, timedelta
 
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
-from google.oauth2 import service_account
-
-from gcsa.google_calendar import GoogleCalendar
 
+from src.calendar_cache import CalendarEventCache
 from src.helper import Helper as helper
-from dotenv import load_dotenv
-from sqlalchemy import all_, create_engine, func
-from sqlalchemy.orm import sessionmaker
+from src.runs import Runs
+from src.sources import Source
 import math
 import asyncio
 from pprint import pprint
 
-
-from models import Base, KeyboardShortcut
-
+# Project categories used by the vectorized classification
+OTHER, PRODUCTIVE, NEUTRAL, WASTED = 0, 1, 2, 3
 
 class Analyzer:
     def __init__(self):
         load_dotenv()
-        DATABASE_URL = os.getenv("DATABASE_URL")
-        print("Creating engine and initializing database")
-        engine = create_engine(DATABASE_URL)
+        self.database_url = os.getenv("DATABASE_URL")
+        # Calendar and Postgres reads are recorded to or replayed from fixtures by SOURCE_MODE
+        self.source = Source.from_env()
+        # SQLAlchemy, the database driver and the Google client stack are only imported when
+        # first used (see the properties below), so a worker boots without loading them.
+        self.lazy_lock = threading.RLock()
+        self._engine = None
+        self._keystrokes = None
+        self._credentials = None
+        self._calendars = None
         # credentials = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
         google_app_type=os.getenv("GOOGLE_APP_TYPE")
         google_app_project_id=os.getenv("GOOGLE_APP_PROJECT_ID")
@@ -71,57 +76,39 @@ class Analyzer:
         }
         
 
-        self.credentials = self.load_credentials(credentials)
-
-        self.calendars = {
-            "unplanned": GoogleCalendar(
-                default_calendar=os.getenv("UNPLANNED_CALENDAR_ID"),
-                credentials=self.credentials,
-            ),
-            "business": GoogleCalendar(
-                default_calendar=os.getenv("BUSINESS_CALENDAR_ID"),
-                credentials=self.credentials,
-            ),
-            "maintenance": GoogleCalendar(
-                default_calendar=os.getenv("MAINTENANCE_CALENDAR_ID"),
-                credentials=self.credentials,
-            ),
-            "sprints": GoogleCalendar(
-                default_calendar=os.getenv("SPRINTS_CALENDAR_ID"),
-                credentials=self.credentials,
-            ),
-            "habits": GoogleCalendar(
-                default_calendar=os.getenv("HABITS_CALENDAR_ID"),
-                credentials=self.credentials,
-            ),
-            "wycik": GoogleCalendar(
-                default_calendar=os.getenv("WYCIK_CALENDAR_ID"),
-                credentials=self.credentials,
-            ),
-            "projects": GoogleCalendar(
-                default_calendar=os.getenv("PROJECTS_CALENDAR_ID"),
-                credentials=self.credentials,
-            ),
-            # "social": GoogleCalendar(
-            #     default_calendar=os.getenv("SOCIAL_CALENDAR_ID"),
-            #     credentials=self.credentials,
-            # ),
-            "technicalities": GoogleCalendar(
-                default_calendar=os.getenv("TECHNICALITIES_CALENDAR_ID"),
-                credentials=self.credentials,
-            ),
-            "understanding": GoogleCalendar(
-                default_calendar=os.getenv("UNDERSTANDING_CALENDAR_ID"),
-                credentials=self.credentials,
-            ),
-            "fptstudio": GoogleCalendar(
-                default_calendar=os.getenv("FPTSTUDIO_CALENDAR_ID"),
-                credentials=self.credentials,
-            ),
+        self.credentials_info = credentials
+
+        self.calendar_ids = {
+            "unplanned": os.getenv("UNPLANNED_CALENDAR_ID"),
+            "business": os.getenv("BUSINESS_CALENDAR_ID"),
+            "maintenance": os.getenv("MAINTENANCE_CALENDAR_ID"),
+            "sprints": os.getenv("SPRINTS_CALENDAR_ID"),
+            "habits": os.getenv("HABITS_CALENDAR_ID"),
+            "wycik": os.getenv("WYCIK_CALENDAR_ID"),
+            "projects": os.getenv("PROJECTS_CALENDAR_ID"),
+            # "social": os.getenv("SOCIAL_CALENDAR_ID"),
+            "technicalities": os.getenv("TECHNICALITIES_CALENDAR_ID"),
+            "understanding": os.getenv("UNDERSTANDING_CALENDAR_ID"),
+            "fptstudio": os.getenv("FPTSTUDIO_CALENDAR_ID"),
         }
 
-        Session = sessionmaker(bind=engine)
-        self.session = Session()
+        # The calendar clients share an httplib2 connection that is not thread
+        # safe, so every client gets its own lock.
+        self.calendar_locks = {name: threading.Lock() for name in self.calendar_ids}
+
+        # Events are kept in memory and brought up to date with incremental syncs,
+        # instead of being listed again from Google Calendar on every request.
+        calendar_sync_interval = int(os.getenv("CALENDAR_SYNC_INTERVAL", 30))
+        self.event_caches = {
+            name: CalendarEventCache(
+                lambda name=name: self.calendars[name],
+                calendar_id,
+                lock=self.calendar_locks[name],
+                sync_interval=calendar_sync_interval,
+                source=self.source,
+            )
+            for name, calendar_id in self.calendar_ids.items()
+        }
 
         self.wasted = {
             "Trading": 2,
@@ -211,8 +198,75 @@ class Analyzer:
             "Formal Working",
             "Emailing",
         ]
+
+        # Category of every known project, resolved in the order the analysis checks them
+        # (productive, then neutral, then wasted), so a project is classified once per lookup
+        self.project_category = {project: WASTED for project in self.wasted}
+        self.project_category.update({project: NEUTRAL for project in self.neutral})
+        self.project_category.update({project: PRODUCTIVE for project in self.productive})
     
+    @property
+    def engine(self):
+        """
+        One pooled engine per process; connections are checked out per query
+        and returned to the pool instead of being reopened on every request.
+        """
+        with self.lazy_lock:
+            if self._engine is None:
+                from sqlalchemy import create_engine
+
+                print("Creating engine and initializing database")
+                self._engine = create_engine(
+                    self.database_url,
+                    pool_size=int(os.getenv("DATABASE_POOL_SIZE", 5)),
+                    max_overflow=int(os.getenv("DATABASE_MAX_OVERFLOW", 5)),
+                    pool_pre_ping=True,
+                    pool_recycle=1800,
+                )
+            return self._engine
+
+    @property
+    def keystrokes(self):
+        """Distraction counts are read from per-day keystroke rollups instead of the raw table"""
+        with self.lazy_lock:
+            if self._keystrokes is None:
+                from src.keystrokes import KeystrokeRollup
+
+                self._keystrokes = KeystrokeRollup(
+                    self.engine,
+                    timezone=os.getenv("DASHBOARD_TIMEZONE", "America/New_York"),
+                    source_timezone=os.getenv("KEYSTROKE_TIMEZONE", "UTC"),
+                    trailing_ids=int(os.getenv("KEYSTROKE_TRAILING_IDS", 50_000)),
+                    interval=int(os.getenv("KEYSTROKE_REFRESH_INTERVAL", 60)),
+                )
+            return self._keystrokes
+
+    @property
+    def credentials(self):
+        with self.lazy_lock:
+            if self._credentials is None:
+                self._credentials = self.load_credentials(self.credentials_info)
+            return self._credentials
+
+    @property
+    def calendars(self):
+        """
+        GoogleCalendar clients by name, built on first use. googleapiclient builds the service
+        from its bundled (static) discovery document, no discovery request is made.
+        """
+        with self.lazy_lock:
+            if self._calendars is None:
+                from gcsa.google_calendar import GoogleCalendar
+
+                self._calendars = {
+                    name: GoogleCalendar(default_calendar=calendar_id, credentials=self.credentials)
+                    for name, calendar_id in self.calendar_ids.items()
+                }
+            return self._calendars
+
     def load_credentials(self, credentials):
+        from google.oauth2 import service_account
+
         print("TYPE OF CREDENTIALS")
         print(type(credentials))
         return service_account.Credentials.from_service_account_info(info=credentials)
@@ -317,6 +371,9 @@ class Analyzer:
             str(start_date_prev)[:10], str(end_date_prev)[:10], times - 1
         )
 
+    def get_events(self, name, start, end):
+        return self.event_caches[name].get_events(start, end)
+
     async def get_all_current_events(cal_dic):
         date_before = datetime.now().astimezone() + timedelta(minutes=0)
         date_after = datetime.now().astimezone() + timedelta(minutes=1)
@@ -349,14 +406,8 @@ class Analyzer:
         date_before = datetime.now().astimezone() + timedelta(days=0)
         date_after = datetime.now().astimezone() + timedelta(days=28)
         
-        # This function will work without async/await if `calendar.get_events` is synchronous
-        def get_events_for_calendar(name, calendar):
-            print(name)
-            events = calendar.get_events(date_before, date_after, single_events=True)
-            return list(events)  # Convert generator to list if needed
-
         # Gather events concurrently using asyncio for synchronous methods
-        tasks = [asyncio.to_thread(get_events_for_calendar, name, calendar) for name, calendar in cal_dic.items()]
+        tasks = [asyncio.to_thread(self.get_events, name, date_before, date_after) for name in cal_dic]
         all_events = await asyncio.gather(*tasks)
 
         # Return a flat list of event lists
@@ -369,7 +420,7 @@ class Analyzer:
         
     def calculate_task_pile(self):
         # Use asyncio.run() to run the async function
-        all_events = asyncio.run(self.get_all_daterange_events(self.calendars))
+        all_events = asyncio.run(self.get_all_daterange_events(self.calendar_ids))
 
         task_pile_hours = round(sum((event.end - event.start for event in all_events), timedelta()).total_seconds() / 3600, 3)
 
@@ -386,7 +437,7 @@ class Analyzer:
         )
 
         # Get all events from unplanned calendar
-        all_events = self.calendars['unplanned'].get_events(start_date, end_date, single_events=True)
+        all_events = self.get_events("unplanned", start_date, end_date)
 
         # Initialize total duration and a dictionary for daily totals
         total_duration = 0
@@ -427,7 +478,7 @@ class Analyzer:
             actual_slow_hours / self.max_mindful_slow(data)[1], 5
         )
 
-        start_date, end_date = data["Start date"][0], data["End date"][len(data) - 2]
+        start_date, end_date = str(data["Start"][0])[:10], str(data["End"][len(data) - 2])[:10]
 
         string = f"""From {start_date} to {end_date}
 Mindful Percentage: {actual_mindful_percentage * 100 }%
@@ -457,34 +508,21 @@ actual slow (hours)    : {round(actual_slow_hours, 3)}
             time_df,
             columns=[
                 "Id",
-                "Start date",
-                "Start time",
+                "Start",
                 "Project",
                 "Description",
                 "SecDuration",
             ],
         )
 
-        # Create a new column 'ProjectShifted' to detect consecutive projects
-        df["ProjectShifted"] = df["Project"].shift()
-
-        # Create a 'Group' column to assign a unique group ID for consecutive projects
-        df["Group"] = (df["Project"] != df["ProjectShifted"]).cumsum()
-
-        # Group by the 'Group' column and aggregate the 'SecDuration' using sum()
-        # Also, take the first value of 'Project', 'Start date', 'Start time', and 'Description' for each group
-        grouped = df.groupby("Group").agg(
-            {
-                "Start date": "first",
-                "Start time": "first",
-                "Project": "first",
-                "Description": "first",
-                "SecDuration": "sum",
-            }
-        )
+        # A new run starts whenever the project changes
+        runs = Runs(df["Project"].ne(df["Project"].shift()).to_numpy())
 
-        # Reset the index to flatten the grouped data
-        grouped.reset_index(drop=True, inplace=True)
+        # Take the first value of 'Start', 'Project' and 'Description' of every run, and the
+        # summed 'SecDuration'
+        grouped = df[["Start", "Project", "Description"]].iloc[runs.starts]
+        grouped = grouped.reset_index(drop=True)
+        grouped["SecDuration"] = runs.sum(df["SecDuration"].to_numpy())
 
         # Return the grouped DataFrame
         return grouped
@@ -496,227 +534,181 @@ actual slow (hours)    : {round(actual_slow_hours, 3)}
             time_df,
             columns=[
                 "Id",
-                "Start date",
-                "Start time",
+                "Start",
                 "Project",
                 "Description",
                 "SecDuration",
-                "TagProductive",
-                "TagUnavoidable",
-                "TagUnproductive",
-                "Carryover",
-                "FlowExempt",
+                "TagFlags",
             ],
         )
 
         # Remove all Time entries that have ["Tracking", "Planning", "Eating", "Getting Ready", "Washroom"] , in the Project column and ALSO are under 100 seconds in SecDuration column
         # df = df[~((df['Project'].isin(["Tracking", "Planning", "Eating", "Getting Ready", "Washroom", "Messaging", "Calling", "Maintenance", "People", "Relationship", "Analyzing", "Emailing", "Listening", "Organizing", "Thinking", "Food Prep/Clean/Order", "Recalling", "Unavoidable Intermission", "Technicalities"])) & (df['SecDuration'] < 100))]
 
-        df = df[~df["FlowExempt"]]
+        df = df[~helper.has_tag(df, "FlowExempt")]
 
-        df["TagProductive"] = df["TagProductive"].astype(bool)
-        df["TagUnproductive"] = df["TagUnproductive"].astype(bool)
-        df["TagUnavoidable"] = df["TagUnavoidable"].astype(bool)
+        tag_unproductive = helper.has_tag(df, "Unproductive")
+        tag_unavoidable = helper.has_tag(df, "Unavoidable")
 
         # Mark Projects that are in self.productive as 'Productive'
-        df["TagProductive"] = (
-            (df["Project"].isin(self.productive) | df["TagProductive"])
-            & ~df["TagUnproductive"]
-            & ~df["TagUnavoidable"]
-        )
-        df["TagProductiveCheck"] = df["TagProductive"]
-        df["ProjectTag"] = (
-            df["Project"]
-            + " "
-            + df["TagProductive"].astype(str)
-            + " "
-            + df["TagUnavoidable"].astype(str)
-            + " "
-            + df["TagUnproductive"].astype(str)
-        )
-        df["Shifted ProjectTag"] = df["ProjectTag"].shift()
-        shifted_carryover = df["Carryover"].shift(-1).fillna(False)
-        df["Carryover"] = df["Carryover"] | shifted_carryover
-        df["Shifted Carryover"] = df["Carryover"].shift()
-        df["PreGroup"] = ~(
-            (df["ProjectTag"] == df["ProjectTag"].shift())
-            | (df["Carryover"] & df["Carryover"].shift())
-        )
-        df["Group"] = (
-            ~(
-                (df["ProjectTag"] == df["ProjectTag"].shift())
-                | (df["Carryover"] & df["Carryover"].shift())
+        tag_productive = (
+            (
+                df["Project"].isin(self.productive).to_numpy()
+                | helper.has_tag(df, "Productive")
             )
-        ).cumsum()
-
-        # Group by the 'Group' column, and aggregate the 'SecDuration' using sum()
-        # Also, take the first value of 'Project' for each group
-        grouped = df.groupby("Group").agg(
-            {
-                "Start date": "first",
-                "Start time": "first",
-                "Project": "first",
-                "SecDuration": "sum",
-                "TagProductive": "all",
-                "TagProductiveCheck": "any",
-                "TagUnavoidable": "all",
-                "TagUnproductive": "all",
-            }
+            & ~tag_unproductive
+            & ~tag_unavoidable
         )
 
-        # Update the 'Description' based on whether the group contains more than one row
-        grouped["Description"] = grouped.apply(
-            lambda row: (
-                "General"
-                if len(df[df["Group"] == row.name]) > 1
-                else df[df["Group"] == row.name].iloc[0]["Description"]
-            ),
-            axis=1,
+        # An entry continues the previous run if it has the same project and tags, or if both
+        # entries are carryovers (a carryover also marks the entry right before it)
+        carryover = helper.has_tag(df, "Carryover")
+        carryover[:-1] |= carryover[1:]
+        same_project_tag = df["Project"].eq(df["Project"].shift()).to_numpy()
+        for tag in (tag_productive, tag_unavoidable, tag_unproductive):
+            same_project_tag[1:] &= tag[1:] == tag[:-1]
+        continued_carryover = np.zeros(len(df), dtype=bool)
+        continued_carryover[1:] = carryover[1:] & carryover[:-1]
+
+        runs = Runs(~(same_project_tag | continued_carryover))
+
+        # Every run keeps the values of its first entry, and the summed duration of all of them
+        grouped = df[["Start", "Project"]].iloc[runs.starts]
+        grouped = grouped.reset_index(drop=True)
+        # Runs of more than one entry get a generic description
+        grouped["Description"] = np.where(
+            runs.sizes > 1, "General", runs.first(df["Description"].to_numpy(dtype=object))
         )
-
-        if not grouped["TagProductive"].equals(grouped["TagProductiveCheck"]):
-            dfPrint = grouped[
-                ~grouped["TagProductive"].eq(grouped["TagProductiveCheck"])
-            ]
-            print(dfPrint[["Start date", "Start time", "Project"]])
+        grouped["SecDuration"] = runs.sum(df["SecDuration"].to_numpy())
+        grouped["TagProductive"] = runs.all(tag_productive)
+        grouped["TagUnavoidable"] = runs.all(tag_unavoidable)
+        grouped["TagUnproductive"] = runs.all(tag_unproductive)
+
+        tag_productive_check = runs.any(tag_productive)
+        if not np.array_equal(grouped["TagProductive"].to_numpy(), tag_productive_check):
+            dfPrint = grouped.set_index(pd.Index(runs.labels[runs.starts], name="Group"))
+            dfPrint = dfPrint[grouped["TagProductive"].to_numpy() != tag_productive_check]
+            print(dfPrint[["Start", "Project"]])
             raise ValueError(
                 "ERROR: TagProductive and TagProductiveCheck are not the same"
             )
 
-        # Reset the index
-        grouped.reset_index(drop=True, inplace=True)
-        grouped = grouped[
-            [
-                "Start date",
-                "Start time",
-                "Project",
-                "Description",
-                "SecDuration",
-                "TagProductive",
-                "TagUnavoidable",
-                "TagUnproductive",
-            ]
-        ]
         return grouped
-    
-    def calculate_distraction_counts(self, start_date, end_date, week=False):
-            # Getting Distraction Data
-        start_datetime = datetime.strptime(start_date, "%Y-%m-%d")
-        end_datetime = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
-
-        daily_counts = self.session.query(
-            func.date(KeyboardShortcut.time).label('date'),
-            func.count(KeyboardShortcut.keyboard_shortcut).label('count')
-        ).filter(
-            KeyboardShortcut.keyboard_shortcut == 'Command + `',
-            KeyboardShortcut.time.between(start_datetime, end_datetime)
-        ).group_by(
-            func.date(KeyboardShortcut.time)
-        ).order_by(
-            func.date(KeyboardShortcut.time)
-        ).all()
-
-        self.session.close()
-
-        distraction_counts = {str(count[0]): math.ceil(count[1] / 2) for count in daily_counts}
+
+    def calculate_distraction_counts(self, start_date, end_date, week=False, timezone=None):
+        """
+        :param timezone: timezone the days are cut in, DASHBOARD_TIMEZONE by default
+        """
+        # Getting Distraction Data
+        daily_counts = self.source.call(
+            "postgres",
+            {
+                "query": "keystroke_daily_counts",
+                "shortcut": "Command + `",
+                "start_date": str(start_date)[:10],
+                "end_date": str(end_date)[:10],
+                "timezone": timezone,
+            },
+            lambda: self.keystrokes.daily_counts(
+                "Command + `", start_date, end_date, timezone=timezone
+            ),
+        )
+
+        distraction_counts = {date: math.ceil(count / 2) for date, count in daily_counts.items()}
         if week:
             return distraction_counts
         else:
             return sum(distraction_counts.values())
 
-    def calculate_1HUT(self, time_df, week=False):
+    def calculate_1HUT(self, time_df, week=False, grouped_df=None):
+        """
+        :param grouped_df: group_df(time_df) if the caller already grouped the entries
+        """
         # display(Markdown("## p1HUT: Productive >1H Uninterrupted Time"))
         flow_threshold = 50
         daily_totals = {}
         p1HUT_dict, n1HUT_dict, nw1HUT_dict, w1HUT_dict = {}, {}, {}, {}
 
-        time_df["TagProductive"] = time_df["Tags"].str.contains("Productive")
-        time_df["TagUnproductive"] = time_df["Tags"].str.contains("Unproductive")
-        time_df["TagUnavoidable"] = time_df["Tags"].str.contains("Unavoidable")
-        time_df["Carryover"] = time_df["Tags"].str.contains("Carryover")
-        time_df["FlowExempt"] = time_df["Tags"].str.contains("FlowExempt")
-
-        productive = self.productive
-        wasted = self.wasted
-        neutral = self.neutral
-
-        time_df = self.group_df(time_df)
-        for index in time_df.index:
-            task_seconds = int(time_df.loc[index, "SecDuration"])
-            project = time_df.loc[index, "Project"]
-            task_date = time_df.at[index, "Start date"]  # Assuming 'Date' column exists
-            tag_productive, tag_unavoidable, tag_unproductive = (
-                time_df.at[index, "TagProductive"],
-                time_df.at[index, "TagUnavoidable"],
-                time_df.at[index, "TagUnproductive"],
+        time_df = self.group_df(time_df) if grouped_df is None else grouped_df
+
+        task_seconds = time_df["SecDuration"].to_numpy().astype(np.int64)
+        category = helper.lookup(time_df["Project"], self.project_category, OTHER).astype(int)
+        # Hours of the project that are allowed before it counts as wasted (NaN if there is none)
+        allowance = helper.lookup(time_df["Project"], self.wasted, np.nan).astype(float)
+        tag_productive = time_df["TagProductive"].to_numpy(dtype=bool)
+        tag_unavoidable = time_df["TagUnavoidable"].to_numpy(dtype=bool)
+        tag_unproductive = time_df["TagUnproductive"].to_numpy(dtype=bool)
+
+        neg_dic = ["Sleep"]
+        flow = (task_seconds > 60 * flow_threshold) & ~time_df["Project"].isin(
+            neg_dic
+        ).to_numpy()
+        is_productive = flow & (category == PRODUCTIVE)
+        is_neutral = flow & (category == NEUTRAL)
+        is_wasted = flow & (category == WASTED)
+
+        productive_neutral = is_productive & tag_unavoidable
+        productive_unproductive = is_productive & ~tag_unavoidable & tag_unproductive
+        productive_other = is_productive & ~tag_unavoidable & ~tag_unproductive
+        productive_productive = productive_other & tag_productive
+        untagged = productive_other & ~tag_productive
+        neutral_productive = is_neutral & tag_productive
+        neutral_unproductive = is_neutral & ~tag_productive & tag_unproductive
+        neutral_neutral = is_neutral & ~tag_productive & ~tag_unproductive
+        wasted_productive = is_wasted & tag_productive
+        wasted_neutral = is_wasted & ~tag_productive & tag_unavoidable
+        wasted_wasted = is_wasted & ~tag_productive & ~tag_unavoidable
+
+        unproductive = productive_unproductive | neutral_unproductive
+        missing_allowance = unproductive & np.isnan(allowance)
+        # Fail on the first offending task, like a walk through the tasks in order would
+        errors = np.flatnonzero(untagged | missing_allowance)
+        if len(errors):
+            index = errors[0]
+            if missing_allowance[index]:
+                raise KeyError(time_df.at[index, "Project"])
+            print("PLEASE TAG YOUR CARRYOVER TASKS PROPERLY")
+            print(
+                str(time_df.at[index, "Start"])[:10],
+                str(time_df.at[index, "Start"])[11:19],
+                time_df.at[index, "Project"],
+                time_df.at[index, "Description"][:10],
+                task_seconds[index] / 3600,
             )
-            if task_date not in daily_totals:
-                daily_totals[task_date] = {
-                    "productive": 0,
-                    "neutral": 0,
-                    "non_wasted": 0,
-                    "wasted": 0,
-                }
+            raise ValueError("PLEASE TAG YOUR CARRYOVER TASKS PROPERLY")
+
+        over_allowance = task_seconds / 3600 > allowance
+        allowance_seconds = allowance * 3600
+        excess_seconds = task_seconds - allowance_seconds
+        totals = pd.DataFrame(
+            {
+                "productive": np.where(
+                    productive_productive | neutral_productive | wasted_productive,
+                    task_seconds,
+                    0,
+                ),
+                "neutral": np.where(
+                    productive_neutral | neutral_neutral | wasted_neutral, task_seconds, 0
+                ),
+                "non_wasted": np.where(unproductive, task_seconds, 0)
+                + np.where(
+                    wasted_wasted,
+                    np.where(over_allowance, allowance_seconds, task_seconds),
+                    0,
+                ),
+                "wasted": np.where(
+                    (unproductive | wasted_wasted) & over_allowance, excess_seconds, 0
+                ),
+            }
+        )
+        totals = totals.groupby(helper.day(time_df["Start"])).sum()
+        daily_totals = {
+            str(task_date)[:10]: {
+                metric: float(seconds) for metric, seconds in day_data.items()
+            }
+            for task_date, day_data in totals.to_dict("index").items()
+        }
 
-            neg_dic = ["Sleep"]
-            if task_seconds > 60 * flow_threshold and project not in neg_dic:
-                # print(
-                #     task_date,
-                #     project,
-                #     time_df.loc[index, "Start time"],
-                #     time_df.loc[index, "Description"][:30],
-                #     task_seconds / 3600,
-                # )
-                # print(tag_productive, tag_unavoidable)
-                if project in productive:
-                    if tag_unavoidable:
-                        daily_totals[task_date]["neutral"] += task_seconds
-                    elif tag_unproductive:
-                        daily_totals[task_date]["non_wasted"] += task_seconds
-                        if task_seconds / 3600 > wasted[project]:
-                            # print(task_date, project, task_seconds/3600, wasted[project])
-                            daily_totals[task_date]["wasted"] += (
-                                task_seconds - wasted[project] * 3600
-                            )
-                    elif tag_productive:
-                        daily_totals[task_date]["productive"] += task_seconds
-                    else:
-                        print("PLEASE TAG YOUR CARRYOVER TASKS PROPERLY")
-                        print(
-                            task_date,
-                            time_df.loc[index, "Start time"],
-                            project,
-                            time_df.loc[index, "Description"][:10],
-                            task_seconds / 3600,
-                        )
-                        raise ValueError("PLEASE TAG YOUR CARRYOVER TASKS PROPERLY")
-                elif project in neutral:
-                    if tag_productive:
-                        daily_totals[task_date]["productive"] += task_seconds
-                    elif tag_unproductive:
-                        daily_totals[task_date]["non_wasted"] += task_seconds
-                        if task_seconds / 3600 > wasted[project]:
-                            # print(task_date, project, task_seconds/3600, wasted[project])
-                            daily_totals[task_date]["wasted"] += (
-                                task_seconds - wasted[project] * 3600
-                            )
-                    else:
-                        daily_totals[task_date]["neutral"] += task_seconds
-                elif project in wasted:
-                    if tag_productive:
-                        daily_totals[task_date]["productive"] += task_seconds
-                    elif tag_unavoidable:
-                        daily_totals[task_date]["neutral"] += task_seconds
-                    else:
-                        if task_seconds / 3600 > wasted[project]:
-                            # print(task_date, project, task_seconds/3600, wasted[project])
-                            daily_totals[task_date]["non_wasted"] += wasted[project] * 3600
-                            daily_totals[task_date]["wasted"] += (
-                                task_seconds - wasted[project] * 3600
-                            )
-                        else:
-                            daily_totals[task_date]["non_wasted"] += task_seconds
-                            
         if week:
             for date in sorted(daily_totals.keys()):
                 day_data = daily_totals[date]
@@ -775,16 +767,18 @@ actual slow (hours)    : {round(actual_slow_hours, 3)}
 
     def efficiency(self, loader, data, debug=False, week=False):
         self.debug = debug
-        productive = self.productive
         wasted = self.wasted
-        neutral = self.neutral
 
-        data["TagProductive"] = data["Tags"].str.contains("Productive")
-        data["TagUnavoidable"] = data["Tags"].str.contains("Unavoidable")
-        data["SecDuration"] = data["SecDuration"].astype(int)
         grouped_data = (
-            data.groupby(["Start date", "Project", "TagProductive", "TagUnavoidable"])
-            .sum(numeric_only=True)
+            data[["Project"]]
+            .assign(
+                SecDuration=data["SecDuration"].astype(int),
+                Day=helper.day(data["Start"]),
+                TagProductive=helper.has_tag(data, "Productive"),
+                TagUnavoidable=helper.has_tag(data, "Unavoidable"),
+            )
+            .groupby(["Day", "Project", "TagProductive", "TagUnavoidable"], observed=True)
+            .sum()
             .reset_index()
         )
 
@@ -799,47 +793,41 @@ actual slow (hours)    : {round(actual_slow_hours, 3)}
             "non_wasted": {},
         }
 
-        # Processing each day and project
-        for date, group in grouped_data.groupby("Start date"):
-            day_totals = {key: 0 for key in daily_metrics.keys()}
-            for _, row in group.iterrows():
-                project, seconds = row["Project"], row["SecDuration"]
-                tag_productive, tag_unavoidable = (
-                    row["TagProductive"],
-                    row["TagUnavoidable"],
-                )
-                day_totals["hours_free"] += seconds
-
-                if project in neutral:
-                    if tag_productive:
-                        productive_seconds = seconds
-                        day_totals["productive"] += productive_seconds
-                    else:
-                        day_totals["hours_free"] -= seconds
-                        day_totals["neutral"] += seconds
-                elif project in productive:
-                    day_totals["productive"] += seconds
-                    if tag_unavoidable:
-                        neutral_seconds = seconds
-                        day_totals["neutral"] += neutral_seconds
-                        day_totals["hours_free"] -= neutral_seconds
-                elif project in wasted.keys():
-                    wasted_seconds = seconds  # 3600
-                    if tag_productive:
-                        productive_seconds = seconds
-                        wasted_seconds -= productive_seconds
-                        day_totals["productive"] += productive_seconds
-                    elif tag_unavoidable:
-                        neutral_seconds = seconds
-                        wasted_seconds -= neutral_seconds
-                        day_totals["neutral"] += neutral_seconds
-                        day_totals["hours_free"] -= neutral_seconds
-                    non_wasted_seconds = min(wasted_seconds, wasted[project] * 3600)
-                    day_totals["non_wasted"] += non_wasted_seconds
-                    day_totals["wasted"] += wasted_seconds - non_wasted_seconds
-
-            for metric, value in day_totals.items():
-                daily_metrics[metric][str(date)[:10]] = round(value / 3600, 3)
+        # Classifying every (day, project, tags) total at once
+        seconds = grouped_data["SecDuration"].to_numpy()
+        category = helper.lookup(grouped_data["Project"], self.project_category, OTHER).astype(int)
+        tag_productive = grouped_data["TagProductive"].to_numpy(dtype=bool)
+        tag_unavoidable = grouped_data["TagUnavoidable"].to_numpy(dtype=bool)
+
+        is_neutral = category == NEUTRAL
+        is_productive = category == PRODUCTIVE
+        is_wasted = category == WASTED
+        to_productive = is_productive | ((is_neutral | is_wasted) & tag_productive)
+        to_neutral = (
+            (is_neutral & ~tag_productive)
+            | (is_productive & tag_unavoidable)
+            | (is_wasted & ~tag_productive & tag_unavoidable)
+        )
+        # Wasted projects only count time that isn't tagged otherwise, up to the daily allowance
+        wasted_seconds = np.where(is_wasted & ~to_productive & ~to_neutral, seconds, 0)
+        allowance = helper.lookup(grouped_data["Project"], wasted, 0).astype(float) * 3600
+        non_wasted_seconds = np.minimum(wasted_seconds, allowance)
+
+        totals = pd.DataFrame(
+            {
+                "hours_free": seconds - np.where(to_neutral, seconds, 0),
+                "efficiency": 0,
+                "inefficiency": 0,
+                "productive": np.where(to_productive, seconds, 0),
+                "neutral": np.where(to_neutral, seconds, 0),
+                "wasted": wasted_seconds - non_wasted_seconds,
+                "non_wasted": non_wasted_seconds,
+            }
+        )
+        totals = totals.groupby(grouped_data["Day"].to_numpy()).sum()
+        for metric in daily_metrics:
+            for date, value in totals[metric].items():
+                daily_metrics[metric][str(date)[:10]] = round(float(value) / 3600, 3)
 
         # Calculating hours free and efficiency for each day and adding to daily_metrics
         for date in daily_metrics["hours_free"]:
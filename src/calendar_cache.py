@@ -0,0 +1,131 @@
+import threading
+import time
+from datetime import date, datetime
+
+from tzlocal import get_localzone
+
+from src.sources import Source
+
+
+class CalendarEventCache:
+    """
+    In-memory copy of the events of one Google Calendar, kept current with incremental sync.
+    The first sync lists every event once and keeps the `nextSyncToken` of the last page, later
+    syncs send that token and only receive the events that changed since (cancelled ones
+    included). A token the API no longer accepts (410 Gone) falls back to a full sync. Syncs run
+    at most once every `sync_interval` seconds, range queries in between are answered from memory.
+    Recurring events are stored as their single instances, like `get_events(single_events=True)`
+    returned them.
+    """
+
+    def __init__(self, calendar, calendar_id, lock=None, sync_interval=30, source=None):
+        """
+        :param calendar: function returning the gcsa GoogleCalendar the events are listed with,
+        called on the first live sync so the client is only built when needed
+        :param calendar_id: id of the cached calendar
+        :param lock: lock guarding the calendar's (not thread safe) http client
+        :param source: Source the listings are recorded to or replayed from
+        """
+        self.get_calendar = calendar
+        self.calendar_id = calendar_id
+        self.source = source or Source()
+        self.lock = lock or threading.Lock()
+        self.sync_interval = sync_interval
+        self.events = {}
+        self.sync_token = None
+        self.synced_at = 0.0
+        # Bumped by every sync that changed an event
+        self.version = 0
+
+    def get_events(self, start, end):
+        """
+        Events overlapping [start, end), in start order. Naive datetimes are read in the local
+        timezone, like gcsa does for its timeMin/timeMax.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.sync_token is None or now - self.synced_at > self.sync_interval:
+                self._sync()
+                self.synced_at = now
+            events = list(self.events.values())
+
+        start, end = self._aware(start), self._aware(end)
+        return sorted(
+            (
+                event
+                for event in events
+                if self._aware(event.start) < end and self._aware(event.end) > start
+            ),
+            key=lambda event: self._aware(event.start),
+        )
+
+    def sync(self):
+        """Syncs now, regardless of `sync_interval`"""
+        with self.lock:
+            self._sync()
+            self.synced_at = time.monotonic()
+
+    def invalidate(self):
+        """Drops the events and the token, the next query runs a full sync"""
+        with self.lock:
+            self.events = {}
+            self.sync_token = None
+
+    def _sync(self):
+        from googleapiclient.errors import HttpError
+
+        if self.sync_token is not None:
+            try:
+                self._list(syncToken=self.sync_token)
+                return
+            except HttpError as error:
+                if error.resp.status != 410:
+                    raise
+                print("calendar sync token expired, running a full sync")
+        self.events = {}
+        self.sync_token = None
+        self._list()
+
+    def _list(self, **params):
+        from gcsa.serializers.event_serializer import EventSerializer
+
+        page_token = None
+        while True:
+            request = {
+                "calendarId": self.calendar_id,
+                "singleEvents": True,
+                "pageToken": page_token,
+                **params,
+            }
+            response = self.source.call(
+                "calendar",
+                request,
+                lambda: self.get_calendar().service.events().list(**request).execute(),
+                # A sync token without a recording replays as "nothing changed"
+                missing=self._unchanged if "syncToken" in params else None,
+            )
+            if response.get("items"):
+                self.version += 1
+            for item in response.get("items", []):
+                event_id = item["id"]
+                if item.get("status") == "cancelled":
+                    self.events.pop(event_id, None)
+                else:
+                    self.events[event_id] = EventSerializer.to_object(item)
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                self.sync_token = response.get("nextSyncToken")
+                return
+
+    @staticmethod
+    def _unchanged(request):
+        return {"items": [], "nextSyncToken": request["syncToken"]}
+
+    @staticmethod
+    def _aware(value):
+        ## All-day events start and end at local midnight
+        if not isinstance(value, datetime) and isinstance(value, date):
+            value = datetime(value.year, value.month, value.day)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=get_localzone())
+        return value
@@ -80,6 +80,17 @@ TIME_MAP = {
     "Mentoring": "🤝 in a Meeting",
     "Formal Working": "👨‍💻 at Job",
     "Emailing": "📧 Processing Emails",
+    "No Project": "❓ Doing Something Untracked",
+    "No Activity": "💤 Not Tracking Anything",
 }
 
-__all__ = ["TIME_MAP"]
+# Bit of every tag the analysis looks at, combined into the "TagFlags" column of the time data
+TAG_FLAGS = {
+    "Productive": 1 << 0,
+    "Unproductive": 1 << 1,
+    "Unavoidable": 1 << 2,
+    "Carryover": 1 << 3,
+    "FlowExempt": 1 << 4,
+}
+
+__all__ = ["TIME_MAP", "TAG_FLAGS"]
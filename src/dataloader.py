@@ -1,12 +1,30 @@
 import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import numpy as np
 import pandas as pd
 import pytz  # Make sure to import pytz for timezone data
-import requests
 from dotenv import load_dotenv
 
+from src.helper import Helper
+from src.http_client import pooled_session
+from src.lookup import LookupCache
+from src.rollup import MetricsRollup
+from src.sources import Source
+from src.store import TimeEntryStore
+
+# Toggl only keeps a limited history of modifications, older syncs redownload the days instead
+MAX_DELTA_AGE = 30 * 24 * 3600
+# Re-read a little before the last sync so edits racing the previous sync are not missed
+DELTA_OVERLAP = 60
+# Largest page the Reports API returns, the rest of a range is reached through X-Next-* headers
+REPORT_PAGE_SIZE = 50
+# Bytes read from a streamed response at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 class DataLoader:
     """
@@ -25,13 +43,66 @@ class DataLoader:
         self.TOGGL_WORKSPACE_ID = os.getenv("TOGGL_WORKSPACE_ID")
         self.NOTION_TOKEN_V2 = os.getenv("NOTION_TOKEN_V2")
 
-    def fetch_data(self, start_date=None, end_date=None, tasks_ago=None, timezone="America/New_York"):
+        # Every Toggl call goes through one pooled session with timeouts and retries, and is
+        # recorded to or replayed from fixtures depending on SOURCE_MODE
+        self.source = Source.from_env()
+        self.http = pooled_session(
+            pool_size=int(os.getenv("TOGGL_POOL_SIZE", 16)),
+            connect_timeout=float(os.getenv("TOGGL_CONNECT_TIMEOUT", 5)),
+            read_timeout=float(os.getenv("TOGGL_READ_TIMEOUT", 30)),
+            retries=int(os.getenv("TOGGL_RETRIES", 4)),
+            max_retry_after=float(os.getenv("TOGGL_MAX_RETRY_AFTER", 10)),
+            source=self.source,
+            kind="toggl",
+        )
+
+        store_path = os.getenv("TIME_ENTRY_STORE_PATH", "time_entries.sqlite3")
+        if self.source.mode != "live":
+            ## Recording and replaying start from an empty store of their own, every Toggl call
+            ## of the run is made (and recorded), and the real store is never synced from fixtures
+            store_path = os.path.join(
+                tempfile.mkdtemp(prefix=f"{self.source.mode}-"), "time_entries.sqlite3"
+            )
+        self.store = TimeEntryStore(store_path)
+        # Per-day metrics of closed days, dropped again when a sync changes their entries
+        self.rollup = MetricsRollup(self.store.path)
+
+        # Projects and tags rarely change, so their maps are cached for the worker's lifetime
+        lookup_ttl = int(os.getenv("TOGGL_LOOKUP_TTL", 3600))
+        self.projects = LookupCache(
+            lambda: self._get_project_list(self.TOGGL_WORKSPACE_ID, self.TOGGL_API_KEY),
+            ttl=lookup_ttl,
+        )
+        self.tags = LookupCache(
+            lambda: self._get_tag_list(self.TOGGL_WORKSPACE_ID, self.TOGGL_API_KEY),
+            ttl=lookup_ttl,
+        )
+
+        # Long downloads are split into date chunks, paged through side by side
+        self.report_chunk_days = int(os.getenv("TOGGL_REPORT_CHUNK_DAYS", 31))
+        self.report_concurrency = int(os.getenv("TOGGL_REPORT_CONCURRENCY", 4))
+
+    def invalidate_lookups(self):
+        """Forgets the cached project and tag maps, the next lookup fetches them again"""
+        self.projects.invalidate()
+        self.tags.invalidate()
+
+    def fetch_data(
+        self,
+        start_date=None,
+        end_date=None,
+        tasks_ago=None,
+        timezone="America/New_York",
+        sync=True,
+    ):
         """
-        Interacts with Toggl REST API and gets the minute data from the date range given.
+        Gets the minute data from the date range given. The local store is synced with the Toggl
+        REST API first, so only days never seen before and recently modified entries are downloaded.
         If start and end date are the same, the data for that day will be shown (non-inclusive)
         :param workspace_id: Your Toggl workspace id (provided in website)
         :param start_date: the starting date of the data
         :param end_date: the ending date of the data
+        :param sync: sync the store first, off when the caller just synced the range
         :return: pandas dataframe, the time data
         """
         # Assuming they did not pass in a start and end date
@@ -47,74 +118,199 @@ class DataLoader:
 
         print("start date", start_date, "end date", end_date)
 
-        data = requests.post(
-            f"https://api.track.toggl.com/reports/api/v3/workspace/{self.TOGGL_WORKSPACE_ID}/search/time_entries",
-            json={
-                "order_by": "date",
-                "order_dir": "ASC",
-                "page_size": 100_000,
-                "start_date": start_date,
-                "end_date": end_date,
-            },
-            headers={"content-type": "application/json"},
-            auth=(self.TOGGL_API_KEY, "api_token"),
-        ).json()
-
-
-        tag_dic = self._get_tag_list(self.TOGGL_WORKSPACE_ID, self.TOGGL_API_KEY)
-        project_dic = self._get_project_list(
-            self.TOGGL_WORKSPACE_ID, self.TOGGL_API_KEY
-        )
-
-        # Converting JSON into a list of lists format
-        for dic in data:
-            dic.update(dic["time_entries"][0])
-            dic["tags"] = [tag_dic[tag] for tag in dic["tag_ids"]]
-            dic["end"] = dic.pop("stop")
-            dic["project"] = project_dic[dic.pop("project_id")]
+        if sync:
+            self.sync(start_date, end_date, timezone)
 
-            del dic["tag_ids"]
-            del dic["time_entries"]
+        range_start, range_end = self._day_bounds(start_date, end_date, zone)
+        data = self.store.entries_between(range_start, range_end)
 
         # Data Cleaning and processing
-        ## Creating pandas dataframe from columns and data
-
-        df2 = pd.DataFrame(data)
-        ## Capitalize the first letter of every column
-        df2.columns = [column[0].upper() + column[1:] for column in df2.columns]
-
-        ## Choosing which columns to be used
-        df2 = df2[["Id", "Project", "Description", "Start", "End", "Tags"]]
-        ## Separating start_date column from start_time column and end_date from end_time
-        df2["Start date"] = np.array([i[:10] for i in df2["Start"].values])
-        df2["End date"] = np.array([i[:10] for i in df2["End"].values])
-        df2["Start time"] = np.array([i[11:19] for i in df2["Start"].values])
-        df2["End time"] = np.array([i[11:19] for i in df2["End"].values])
+        ## Creating pandas dataframe from the stored columns
+        df2 = pd.DataFrame(
+            {
+                "Id": data["id"],
+                "Project": data["project_id"],
+                "Description": data["description"],
+                "Tags": data["tag_ids"],
+                "Start": data["start"],
+                "End": data["stop"],
+            }
+        )
+        df2["Project"] = self.projects.get_many(list(df2["Project"]), "No Project")
+        tag_ids = list({tag for tags in df2["Tags"] for tag in tags})
+        tag_dic = dict(zip(tag_ids, self.tags.get_many(tag_ids)))
+        ## Tags deleted in Toggl are dropped instead of failing the whole request
+        df2["Tags"] = [
+            [tag_dic[tag] for tag in tags if tag_dic[tag] is not None]
+            for tags in df2["Tags"]
+        ]
+        ## Parsing the tags once, the analysis only reads the flags
+        df2["TagFlags"] = Helper.tag_flags(df2["Tags"])
         df2["Tags"] = np.array(
             [
                 ", ".join([str(tag).strip("''[]") for tag in tagList])
                 for tagList in df2["Tags"].values
-            ]
+            ],
+            dtype=object,
         )
-        ## Adding a column that converts the datetime difference into a duration
-        df2["SecDuration"] = self._duration_in_seconds(df2)
-        # df2['Duration']
+        ## Projects repeat a lot, a categorical stores every name once
+        df2["Project"] = df2["Project"].astype("category")
+        ## The duration is the difference of the stored UTC timestamps
+        df2["SecDuration"] = (df2["End"] - df2["Start"]).to_numpy(dtype=np.int32)
+        ## Converting the stored UTC timestamps into local tz-aware datetimes
+        for column in ["Start", "End"]:
+            df2[column] = pd.to_datetime(df2[column], unit="s", utc=True).dt.tz_convert(
+                zone
+            )
         df2 = df2[
             [
                 "Id",
                 "Project",
                 "Description",
-                "Start date",
-                "Start time",
-                "End date",
-                "End time",
+                "Start",
+                "End",
                 "Tags",
+                "TagFlags",
                 "SecDuration",
             ]
         ]
 
         return df2
 
+    def sync(self, start_date, end_date, timezone="America/New_York"):
+        """
+        Brings the local store up to date for the given date range. Entries modified since the
+        last sync are pulled with one delta call, and only days that were never downloaded
+        before are fetched from the Reports API.
+        :param start_date: the starting date of the range, "YYYY-MM-DD"
+        :param end_date: the ending date of the range (inclusive), "YYYY-MM-DD"
+        """
+        zone = pytz.timezone(timezone)
+        with self.store.lock:
+            now = int(time.time())
+            last_sync = self.store.get_state("last_sync")
+            if last_sync is None or now - int(last_sync) > MAX_DELTA_AGE:
+                self.store.forget_days()
+                self.rollup.clear()
+            else:
+                modified = self._fetch_modified_entries(int(last_sync) - DELTA_OVERLAP)
+                ## Days an entry was moved out of or into have to be computed again
+                self.rollup.invalidate(
+                    self.store.starts([entry["id"] for entry in modified])
+                    + [entry["start"] for entry in modified if not entry["deleted"]]
+                )
+                self.store.upsert(
+                    [entry for entry in modified if not entry["deleted"]]
+                )
+                self.store.delete(
+                    [entry["id"] for entry in modified if entry["deleted"]]
+                )
+            self.store.set_state("last_sync", now)
+
+            days = [str(day)[:10] for day in pd.date_range(start_date, end_date)]
+            missing = self.store.missing_days(days)
+            if missing:
+                print("downloading", missing[0], "to", missing[-1])
+                self.store.delete_range(*self._day_bounds(missing[0], missing[-1], zone))
+                self._download_report_entries(missing[0], missing[-1])
+                self.store.mark_synced(
+                    [str(day)[:10] for day in pd.date_range(missing[0], missing[-1])]
+                )
+
+    def _download_report_entries(self, start_date, end_date):
+        """
+        Downloads every entry of the range from the Reports API into the store. The range is cut
+        into chunks of `report_chunk_days` days that are fetched at most `report_concurrency` at
+        a time. Every page is written to the store as soon as it is decoded, so memory holds one
+        page per chunk instead of the whole range.
+        """
+        days = pd.date_range(start_date, end_date)
+        chunks = [
+            (str(days[i])[:10], str(days[min(i + self.report_chunk_days, len(days)) - 1])[:10])
+            for i in range(0, len(days), self.report_chunk_days)
+        ]
+        if len(chunks) == 1:
+            self._download_report_chunk(*chunks[0])
+            return
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.report_concurrency, len(chunks))
+        ) as pool:
+            # list() re-raises the first failed chunk
+            list(pool.map(lambda chunk: self._download_report_chunk(*chunk), chunks))
+
+    def _download_report_chunk(self, start_date, end_date):
+        """Pages through one date range, following the X-Next-ID / X-Next-Row-Number headers"""
+        body = {
+            "order_by": "date",
+            "order_dir": "ASC",
+            "page_size": REPORT_PAGE_SIZE,
+            "start_date": start_date,
+            "end_date": end_date,
+        }
+        while True:
+            with self.http.post(
+                f"https://api.track.toggl.com/reports/api/v3/workspace/{self.TOGGL_WORKSPACE_ID}/search/time_entries",
+                json=body,
+                headers={"content-type": "application/json"},
+                auth=(self.TOGGL_API_KEY, "api_token"),
+                stream=True,
+            ) as response:
+                ## A failed page must not pass for the end of the range
+                response.raise_for_status()
+                ## Rows are decoded one by one while the page streams into the store
+                self.store.upsert(
+                    {
+                        "id": entry["id"],
+                        "project_id": row["project_id"],
+                        "description": row["description"],
+                        "tag_ids": row["tag_ids"],
+                        "start": self._timestamp(entry["start"]),
+                        "stop": self._timestamp(entry["stop"]),
+                        "at": self._timestamp(entry["at"]),
+                    }
+                    for row in Helper.iter_json_array(response.iter_content(STREAM_CHUNK_SIZE))
+                    for entry in row["time_entries"]
+                )
+                next_id = response.headers.get("X-Next-ID")
+                next_row_number = response.headers.get("X-Next-Row-Number")
+
+            if not next_id or not next_row_number:
+                break
+            body = {
+                **body,
+                "first_id": int(next_id),
+                "first_row_number": int(next_row_number),
+            }
+
+    def _fetch_modified_entries(self, since):
+        with self.http.get(
+            "https://api.track.toggl.com/api/v9/me/time_entries",
+            params={"since": since},
+            headers={"content-type": "application/json"},
+            auth=(self.TOGGL_API_KEY, "api_token"),
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            return [
+                {
+                    "id": entry["id"],
+                    "project_id": entry["project_id"],
+                    "description": entry["description"],
+                    "tag_ids": entry["tag_ids"],
+                    "start": self._timestamp(entry["start"]),
+                    "stop": self._timestamp(entry["stop"]),
+                    "at": self._timestamp(entry["at"]),
+                    "deleted": entry.get("server_deleted_at") is not None,
+                }
+                for entry in Helper.iter_json_array(
+                    response.iter_content(STREAM_CHUNK_SIZE)
+                )
+                # The running entry has no stop yet, it is appended by get_toggl_current_task
+                if str(entry["workspace_id"]) == str(self.TOGGL_WORKSPACE_ID)
+                and (entry["stop"] is not None or entry.get("server_deleted_at"))
+            ]
+
     def old_fetch_data(self, start_date=None, end_date=None, tasks_ago=None):
         # Assuming they did not pass in a start and end date
         if start_date == None:
@@ -137,7 +333,7 @@ class DataLoader:
 
         # Interacting with API and getting data
         data = []
-        r = requests.get(
+        r = self.http.get(
             url, params=keys, headers=headers, auth=(self.TOGGL_API_KEY, "api_token")
         )
 
@@ -145,7 +341,7 @@ class DataLoader:
         count = 0
         for page in range(1, page_count + 1):
             keys.update(page=page)
-            data_point = requests.get(
+            data_point = self.http.get(
                 url,
                 params=keys,
                 headers=headers,
@@ -166,11 +362,10 @@ class DataLoader:
         df2 = pd.DataFrame(datas2, columns=columns)
         ## Choosing which columns to be used
         df2 = df2[["Id", "Project", "Description", "Start", "End", "Tags"]]
-        ## Separating start_date column from start_time column and end_date from end_time
-        df2["Start date"] = np.array([i[:10] for i in df2["Start"].values])
-        df2["End date"] = np.array([i[:10] for i in df2["End"].values])
-        df2["Start time"] = np.array([i[11:19] for i in df2["Start"].values])
-        df2["End time"] = np.array([i[11:19] for i in df2["End"].values])
+        ## Keeping the local wall time of the start and end
+        df2["Start"] = pd.to_datetime(df2["Start"].str[:19])
+        df2["End"] = pd.to_datetime(df2["End"].str[:19])
+        df2["TagFlags"] = Helper.tag_flags(df2["Tags"])
         df2["Tags"] = np.array([str(i).strip("''[]") for i in df2["Tags"].values])
         ## Adding a column that converts the datetime difference into a duration
         df2["SecDuration"] = self._duration_in_seconds(df2)
@@ -180,11 +375,10 @@ class DataLoader:
                 "Id",
                 "Project",
                 "Description",
-                "Start date",
-                "Start time",
-                "End date",
-                "End time",
+                "Start",
+                "End",
                 "Tags",
+                "TagFlags",
                 "SecDuration",
             ]
         ]
@@ -196,12 +390,11 @@ class DataLoader:
         headers = {"content-type": "application/json"}
         api_token = os.getenv("TOGGL_API_KEY")
         # Interacting with API and getting data
-        r = requests.get(url, headers=headers, auth=(api_token, "api_token"))
+        r = self.http.get(url, headers=headers, auth=(api_token, "api_token"))
+        r.raise_for_status()
         data = r.json()[0]
 
-        projects = self._get_project_list(self.TOGGL_WORKSPACE_ID, self.TOGGL_API_KEY)
-
-        project_name = projects[data["pid"]]
+        project_name = self.projects.get(data["pid"], "No Project")
         del data["pid"]
         data["project"] = project_name
 
@@ -217,36 +410,26 @@ class DataLoader:
 
         df2 = pd.DataFrame([data.values()], columns=columns)
 
-        df2["Start"] = pd.to_datetime(df2["Start"], utc=True)
-        df2["Start"] = df2["Start"].dt.tz_convert(timezone).dt.tz_localize(None)
+        df2["Start"] = pd.to_datetime(df2["Start"], utc=True).dt.tz_convert(timezone)
 
         df2 = df2.drop("At", axis=1)
 
-        df2["End"] = datetime.utcnow().replace(
-            tzinfo=pytz.utc
-        )  # Make 'End' timezone aware
-        df2["End"] = df2["End"].dt.tz_convert(timezone).dt.tz_localize(None)
-
-        secDuration = float((df2["End"] - df2["Start"]).dt.total_seconds())
+        # The running entry ends now, to the second like the stored entries
+        df2["End"] = pd.Timestamp.now(tz=timezone).floor("s")
 
-        df2["SecDuration"] = [int(secDuration)]
-
-        df2["Start date"] = np.array([str(i)[:10] for i in df2["Start"].values])
-        df2["End date"] = np.array([str(i)[:10] for i in df2["End"].values])
-        df2["Start time"] = np.array([str(i)[11:19] for i in df2["Start"].values])
-        df2["End time"] = np.array([str(i)[11:19] for i in df2["End"].values])
+        df2["SecDuration"] = self._duration_in_seconds(df2)
 
         df2["Tags"] = [""]
+        df2["TagFlags"] = Helper.tag_flags([[]])
         df2 = df2[
             [
                 "Id",
                 "Project",
                 "Description",
-                "Start date",
-                "Start time",
-                "End date",
-                "End time",
+                "Start",
+                "End",
                 "Tags",
+                "TagFlags",
                 "SecDuration",
             ]
         ]
@@ -258,7 +441,7 @@ class DataLoader:
             return self.fetch_data(start_date, end_date)
         else:
             date_list = [i.strftime("%Y-%m-%d") for i in datetimes]
-            return df[df["Start date"].isin(date_list)]
+            return df[df["Start"].dt.strftime("%Y-%m-%d").isin(date_list)]
 
     def _clean(self, data):
         df = data[
@@ -271,25 +454,41 @@ class DataLoader:
                 "End date",
                 "End time",
                 "Tags",
-                "SecDuration",
             ]
         ].copy()
+        df["Start"] = pd.to_datetime(df.pop("Start date") + " " + df.pop("Start time"))
+        df["End"] = pd.to_datetime(df.pop("End date") + " " + df.pop("End time"))
         df["Project"].fillna(value="No Project", inplace=True)
         df["Description"].fillna(value="", inplace=True)
         df["Tags"].fillna(value="", inplace=True)
+        df["TagFlags"] = Helper.tag_flags(df["Tags"].str.split(","))
         df["SecDuration"] = self._duration_in_seconds(df)
         return df
 
+    @staticmethod
+    def _timestamp(value):
+        if value is None:
+            return None
+        return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+
+    @staticmethod
+    def _day_bounds(start_date, end_date, zone):
+        """UTC unix seconds of the start of `start_date` and the end of `end_date` in `zone`"""
+        start = zone.localize(datetime.strptime(start_date, "%Y-%m-%d"))
+        end = zone.localize(datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1))
+        return int(start.timestamp()), int(end.timestamp())
+
     def _days_ago(self, number_of_days_ago=0):
         return (datetime.now() - timedelta(days=number_of_days_ago)).strftime(
             "%Y-%m-%d"
         )
 
     def _get_project_list(self, account, api_token):
-        projects = requests.get(
+        projects = self.http.get(
             f"https://api.track.toggl.com/api/v9/workspaces/{account}/projects",
             auth=(api_token, "api_token"),
         )
+        projects.raise_for_status()
         projects_list = projects.json()
         project_id_to_name = {
             project["id"]: project["name"] for project in projects_list
@@ -297,28 +496,17 @@ class DataLoader:
         return project_id_to_name
 
     def _get_tag_list(self, account, api_token):
-        tags = requests.get(
+        tags = self.http.get(
             f"https://api.track.toggl.com/api/v9/workspaces/{account}/tags",
             auth=(api_token, "api_token"),
         )
+        tags.raise_for_status()
         tags_list = tags.json()
         tag_id_to_name = {tag["id"]: tag["name"] for tag in tags_list}
         return tag_id_to_name
 
     def _duration_in_seconds(self, df):
-        startdates = df["Start date"] + "-" + df["Start time"]
-        enddates = df["End date"] + "-" + df["End time"]
-
-        startdates = np.array(
-            [datetime.strptime(i, "%Y-%m-%d-%H:%M:%S") for i in startdates]
-        )
-        enddates = np.array(
-            [datetime.strptime(i, "%Y-%m-%d-%H:%M:%S") for i in enddates]
-        )
-
-        unixS = pd.DatetimeIndex(startdates).astype(np.int64) // 10**9
-        unixE = pd.DatetimeIndex(enddates).astype(np.int64) // 10**9
-        return unixE - unixS
+        return (df["End"] - df["Start"]).dt.total_seconds().to_numpy().astype(np.int32)
 
 
 # Example code that would be run in order to fetch data
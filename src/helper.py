@@ -1,8 +1,12 @@
+import codecs
+import json
 from datetime import datetime, timedelta
 
 import numpy as np
 import pandas as pd
 
+from src.constants import TAG_FLAGS
+
 
 class Helper:
     @staticmethod
@@ -20,6 +24,77 @@ class Helper:
                     )
         return keyword_time / 3600
 
+    @staticmethod
+    def tag_flags(tag_lists) -> np.array:
+        """
+        Parses the tags of every entry once into a TAG_FLAGS bitmask. Only whole tag names match,
+        so "Unproductive" doesn't set the "Productive" bit.
+        :param tag_lists: iterable of lists of tag names
+        """
+        return np.array(
+            [sum({TAG_FLAGS.get(str(tag).strip(), 0) for tag in tags}) for tags in tag_lists],
+            dtype=np.uint8,
+        )
+
+    @staticmethod
+    def has_tag(df, tag) -> np.array:
+        return (df["TagFlags"].to_numpy().astype(np.uint8) & TAG_FLAGS[tag]) != 0
+
+    @staticmethod
+    def day(start: pd.Series) -> np.array:
+        """Local calendar day (as midnight datetime64) of every start time"""
+        if start.dt.tz is not None:
+            start = start.dt.tz_localize(None)
+        return start.dt.normalize().to_numpy()
+
+    @staticmethod
+    def lookup(values: pd.Series, table: dict, default) -> np.array:
+        """
+        Maps every value through `table`. Categorical columns are mapped once per category
+        instead of once per row.
+        """
+        values = pd.Categorical(values)
+        mapped = pd.Series(values.categories).map(table).to_numpy(dtype=object)
+        # Missing values have code -1, which picks the default appended at the end
+        mapped = np.append(mapped, default)
+        mapped[pd.isna(mapped)] = default
+        return mapped[values.codes]
+
+    @staticmethod
+    def iter_json_array(chunks):
+        """
+        Yields the objects of a JSON array as they are decoded from a stream of byte chunks, so
+        only the current object and the unread rest of the last chunk are held in memory.
+        :param chunks: iterable of bytes, e.g. response.iter_content(...)
+        """
+        decoder = json.JSONDecoder()
+        text = codecs.getincrementaldecoder("utf-8")()
+        buffer, position, opened = "", 0, False
+        for chunk in chunks:
+            buffer = buffer[position:] + text.decode(chunk)
+            position = 0
+            while True:
+                ## Skipping whitespace and the separators between objects
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position == len(buffer):
+                    break
+                if not opened:
+                    if buffer[position] != "[":
+                        raise ValueError("Expected a JSON array")
+                    opened = True
+                    position += 1
+                    continue
+                if buffer[position] == "]":
+                    return
+                try:
+                    item, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # The object continues in the next chunk
+                    break
+                yield item
+        raise ValueError("Unterminated JSON array")
+
     @staticmethod
     def fraction_to_float(string):
         string = string.split("/")
@@ -0,0 +1,83 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.sources import SourceAdapter
+
+
+class CappedRetry(Retry):
+    """Retry that waits at most `max_retry_after` seconds for a Retry-After header"""
+
+    def __init__(self, *args, max_retry_after=10, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_retry_after = max_retry_after
+
+    def new(self, **kwargs):
+        # Retry.new only copies the arguments it knows
+        retry = super().new(**kwargs)
+        retry.max_retry_after = self.max_retry_after
+        return retry
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, self.max_retry_after)
+
+
+class TimeoutSession(requests.Session):
+    """requests.Session that applies a default timeout to every call that doesn't set one"""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def pooled_session(
+    pool_size=16,
+    connect_timeout=5,
+    read_timeout=30,
+    retries=4,
+    backoff_factor=0.5,
+    backoff_jitter=0.5,
+    max_retry_after=10,
+    source=None,
+    kind="http",
+):
+    """
+    One keep-alive session per worker, so calls reuse pooled TCP/TLS connections instead of
+    shaking hands every time. 429 and 5xx answers are retried with jittered exponential backoff,
+    waiting for Retry-After when the server sends it, up to `max_retry_after` seconds so a long
+    rate limit can't hold the request thread. After the last retry the error response is
+    returned like any other, callers check the status themselves.
+    :param pool_size: connections kept open per host, at least the number of concurrent calls
+    :param connect_timeout: seconds to wait for a connection
+    :param read_timeout: seconds to wait between bytes of the response
+    :param max_retry_after: longest wait for a Retry-After header, in seconds
+    :param source: Source recording or replaying the calls, as fixtures of `kind`
+    """
+    retry = CappedRetry(
+        total=retries,
+        # A timed out read is only tried once more, so a hung call costs two read timeouts
+        read=1,
+        backoff_factor=backoff_factor,
+        backoff_jitter=backoff_jitter,
+        status_forcelist=(429, 500, 502, 503, 504),
+        # Toggl's POSTs are searches, they are as safe to repeat as the GETs
+        allowed_methods=None,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+        max_retry_after=max_retry_after,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    if source is not None and source.mode != "live":
+        adapter = SourceAdapter(source, kind, adapter)
+
+    session = TimeoutSession(timeout=(connect_timeout, read_timeout))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,347 @@
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import DateTime, and_, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import sessionmaker
+
+from models import (
+    Base,
+    KeyboardShortcut,
+    KeyboardShortcutDaily,
+    KeyboardShortcutHourly,
+    RollupState,
+)
+
+# Rows this close to the newest id are aggregated again on every refresh, see _advance
+TRAILING_IDS = 50_000
+# Buckets recounted per query
+RECOUNT_CHUNK = 200
+
+
+class KeystrokeRollup:
+    """
+    Hourly and daily press counts per keyboard shortcut, maintained incrementally from the raw
+    `keyboard_shortcuts` table. A background thread (`start`) refreshes them every `interval`
+    seconds: a refresh only looks at the rows added since the previous one (tracked by id in
+    `rollup_state`) and recounts the buckets they fall in with upserts, one transaction per
+    batch, so reading a range is a SELECT of O(days) rows however large the raw table grows.
+    The tables, the index on the raw table and the watermarks are created once by `migrate`
+    (`python -m src.keystrokes`), never on the request path.
+    Raw times are read in `source_timezone`. Daily rows are kept for `timezone`, the days of any
+    other timezone are summed from the hourly rows.
+    """
+
+    def __init__(
+        self,
+        engine,
+        timezone="America/New_York",
+        source_timezone="UTC",
+        batch_size=100_000,
+        trailing_ids=TRAILING_IDS,
+        interval=60,
+    ):
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine)
+        self.timezone = timezone
+        self.source_timezone = source_timezone
+        self.batch_size = batch_size
+        self.trailing_ids = trailing_ids
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.hourly_state = "keyboard_shortcuts_hourly"
+        self.daily_state = f"keyboard_shortcuts_daily:{timezone}"
+        self._hour = func.date_trunc("hour", KeyboardShortcut.time, type_=DateTime)
+        # (newest id, rows after the safe horizon) at the last refresh
+        self.seen = None
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+    def daily_counts(self, shortcut, start_date, end_date, timezone=None):
+        """
+        :param start_date: first day, "YYYY-MM-DD"
+        :param end_date: last day (inclusive), "YYYY-MM-DD"
+        :param timezone: timezone the days are cut in, `timezone` by default
+        :return: dict of "YYYY-MM-DD" -> presses, in date order, days without presses are left out
+        """
+        timezone = timezone or self.timezone
+        first_day, last_day = pd.Timestamp(start_date).date(), pd.Timestamp(end_date).date()
+
+        with self.Session() as session:
+            if timezone == self.timezone:
+                rows = session.execute(
+                    select(KeyboardShortcutDaily.day, KeyboardShortcutDaily.count)
+                    .where(
+                        KeyboardShortcutDaily.keyboard_shortcut == shortcut,
+                        KeyboardShortcutDaily.timezone == timezone,
+                        KeyboardShortcutDaily.day.between(first_day, last_day),
+                    )
+                    .order_by(KeyboardShortcutDaily.day)
+                ).all()
+                return {str(day): count for day, count in rows}
+
+            ## Hours of the source timezone that can fall on the requested local days
+            first_hour = pd.Timestamp(start_date) - pd.Timedelta(days=1)
+            last_hour = pd.Timestamp(end_date) + pd.Timedelta(days=2)
+            rows = session.execute(
+                select(KeyboardShortcutHourly.hour, KeyboardShortcutHourly.count).where(
+                    KeyboardShortcutHourly.keyboard_shortcut == shortcut,
+                    KeyboardShortcutHourly.hour >= first_hour.to_pydatetime(),
+                    KeyboardShortcutHourly.hour < last_hour.to_pydatetime(),
+                )
+            ).all()
+
+        counts = defaultdict(int)
+        for hour, count in rows:
+            day = self._local_day(hour, timezone)
+            if first_day <= day <= last_day:
+                counts[str(day)] += count
+        return dict(sorted(counts.items()))
+
+    def ingest(self, events, chunk_size=1000):
+        """
+        Writes a batch of raw keystroke events in one transaction, with multi-row inserts instead
+        of a commit per row. Events repeated within the batch are written once.
+        :param events: list of {"keyboard_shortcut": str, "time": ISO 8601 str}, times with an
+        offset are converted to `source_timezone`
+        :return: list of the times of the rows inserted, as UTC pandas Timestamps
+        """
+        rows = {}
+        for event in events:
+            shortcut, time = event["keyboard_shortcut"], event["time"]
+            if not isinstance(shortcut, str) or not isinstance(time, str):
+                raise ValueError("keyboard_shortcut and time must be strings")
+            time = datetime.fromisoformat(time.replace("Z", "+00:00"))
+            if time.tzinfo is not None:
+                time = (
+                    pd.Timestamp(time).tz_convert(self.source_timezone).tz_localize(None)
+                ).to_pydatetime()
+            rows.setdefault((shortcut, time), {"keyboard_shortcut": shortcut, "time": time})
+        rows = list(rows.values())
+
+        with self.Session.begin() as session:
+            for i in range(0, len(rows), chunk_size):
+                session.execute(
+                    KeyboardShortcut.__table__.insert().values(rows[i : i + chunk_size])
+                )
+        return [
+            pd.Timestamp(row["time"])
+            .tz_localize(self.source_timezone, ambiguous=True, nonexistent="shift_forward")
+            .tz_convert("UTC")
+            for row in rows
+        ]
+
+    def start(self):
+        """Starts the refresher thread, once per process (calls after the first do nothing)"""
+        with self.thread_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="keystroke-rollup", daemon=True
+                )
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as error:
+                print("keystroke rollup refresh failed:", error)
+            time.sleep(self.interval)
+
+    def refresh(self):
+        """
+        Brings the hourly and daily rollups up to date with the raw table, skipped when no row
+        was added since the last refresh
+        """
+        with self.lock:
+            with self.Session() as session:
+                max_id = session.scalar(select(func.max(KeyboardShortcut.id))) or 0
+                ## Late commits add rows below the newest id, they change the count
+                trailing = session.scalar(
+                    select(func.count()).where(
+                        KeyboardShortcut.id > max_id - self.trailing_ids
+                    )
+                )
+            if (max_id, trailing) == self.seen:
+                return
+            self._advance(self.hourly_state, self._replace_hourly, max_id)
+            self._advance(self.daily_state, self._replace_daily, max_id)
+            self.seen = (max_id, trailing)
+
+    def migrate(self):
+        """
+        Creates the rollup tables, the index the recounts read and the watermarks. The index is
+        built CONCURRENTLY on Postgres, writes to the raw table go on while it builds
+        """
+        Base.metadata.create_all(
+            self.engine,
+            tables=[
+                KeyboardShortcutHourly.__table__,
+                KeyboardShortcutDaily.__table__,
+                RollupState.__table__,
+            ],
+        )
+        # create_all skips indexes of tables that already exist
+        for index in KeyboardShortcut.__table__.indexes:
+            if self.engine.dialect.name == "postgresql":
+                ## CONCURRENTLY can't run inside a transaction
+                with self.engine.connect().execution_options(
+                    isolation_level="AUTOCOMMIT"
+                ) as conn:
+                    columns = ", ".join(column.name for column in index.columns)
+                    conn.exec_driver_sql(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index.name} "
+                        f"ON {KeyboardShortcut.__tablename__} ({columns})"
+                    )
+            else:
+                index.create(self.engine, checkfirst=True)
+        with self.Session.begin() as session:
+            for name in (self.hourly_state, self.daily_state):
+                session.execute(
+                    insert(RollupState)
+                    .values(name=name, last_id=0)
+                    .on_conflict_do_nothing(index_elements=["name"])
+                )
+
+    def _advance(self, name, replace, max_id):
+        """
+        Feeds the hourly buckets holding rows after the `name` watermark, up to `max_id`, to
+        `replace`, which recounts them. Each batch commits on its own with the watermark, so a
+        backfill of the whole table never holds one long transaction. The watermark stops
+        `trailing_ids` short of the newest id, ids are taken when a row is inserted but it only
+        shows once its transaction commits, so a row with a lower id can still appear. The
+        trailing rows are fed again on every refresh, recounting makes that harmless.
+        """
+        with self.Session() as session:
+            start = session.scalar(select(RollupState.last_id).where(RollupState.name == name))
+        horizon = max_id - self.trailing_ids
+
+        while start < max_id:
+            upto = min(start + self.batch_size, max_id)
+            with self.Session.begin() as session:
+                buckets = session.execute(
+                    select(KeyboardShortcut.keyboard_shortcut, self._hour)
+                    .where(
+                        KeyboardShortcut.id > start,
+                        KeyboardShortcut.id <= upto,
+                        KeyboardShortcut.time.isnot(None),
+                    )
+                    .distinct()
+                ).all()
+                if buckets:
+                    replace(session, buckets)
+                ## Workers refresh concurrently, the watermark only moves forward
+                watermark = min(upto, horizon)
+                session.execute(
+                    update(RollupState)
+                    .where(RollupState.name == name, RollupState.last_id < watermark)
+                    .values(last_id=watermark)
+                )
+            start = upto
+
+    def _recount(self, session, ranges):
+        """
+        :param ranges: list of (shortcut, start, end), whole hours of raw times that don't overlap
+        :return: dict of (shortcut, hour) -> presses in the ranges
+        """
+        counts = {}
+        for i in range(0, len(ranges), RECOUNT_CHUNK):
+            rows = session.execute(
+                select(KeyboardShortcut.keyboard_shortcut, self._hour, func.count())
+                .where(
+                    or_(
+                        *[
+                            and_(
+                                KeyboardShortcut.keyboard_shortcut == shortcut,
+                                KeyboardShortcut.time >= start,
+                                KeyboardShortcut.time < end,
+                            )
+                            for shortcut, start, end in ranges[i : i + RECOUNT_CHUNK]
+                        ]
+                    )
+                )
+                .group_by(KeyboardShortcut.keyboard_shortcut, self._hour)
+            ).all()
+            counts.update({(shortcut, hour): count for shortcut, hour, count in rows})
+        return counts
+
+    def _replace_hourly(self, session, buckets):
+        ranges = [
+            (shortcut, hour, hour + timedelta(hours=1)) for shortcut, hour in set(buckets)
+        ]
+        counts = self._recount(session, ranges)
+        statement = insert(KeyboardShortcutHourly).values(
+            [
+                {"keyboard_shortcut": shortcut, "hour": hour, "count": count}
+                for (shortcut, hour), count in counts.items()
+            ]
+        )
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["keyboard_shortcut", "hour"],
+                set_={"count": statement.excluded.count},
+            )
+        )
+
+    def _replace_daily(self, session, buckets):
+        touched = {(shortcut, self._local_day(hour, self.timezone)) for shortcut, hour in buckets}
+        ranges = [(shortcut, *self._day_hours(day)) for shortcut, day in touched]
+        days = defaultdict(int)
+        for (shortcut, hour), count in self._recount(session, ranges).items():
+            day = self._local_day(hour, self.timezone)
+            if (shortcut, day) in touched:
+                days[(shortcut, day)] += count
+        statement = insert(KeyboardShortcutDaily).values(
+            [
+                {
+                    "keyboard_shortcut": shortcut,
+                    "timezone": self.timezone,
+                    "day": day,
+                    "count": count,
+                }
+                for (shortcut, day), count in days.items()
+            ]
+        )
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["keyboard_shortcut", "timezone", "day"],
+                set_={"count": statement.excluded.count},
+            )
+        )
+
+    def _day_hours(self, day):
+        """:return: whole hours of raw times (start, end) covering the local `day` of `timezone`"""
+        start, end = (
+            pd.Timestamp(midnight)
+            .tz_localize(self.timezone, ambiguous=True, nonexistent="shift_forward")
+            .tz_convert(self.source_timezone)
+            .tz_localize(None)
+            for midnight in (day, day + timedelta(days=1))
+        )
+        return start.floor("h").to_pydatetime(), end.ceil("h").to_pydatetime()
+
+    def _local_day(self, hour, timezone):
+        return (
+            pd.Timestamp(hour)
+            .tz_localize(self.source_timezone, ambiguous=True, nonexistent="shift_forward")
+            .tz_convert(timezone)
+            .date()
+        )
+
+
+if __name__ == "__main__":
+    ## One-off migration, run before deploying: python -m src.keystrokes
+    import os
+
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+
+    load_dotenv()
+    KeystrokeRollup(
+        create_engine(os.getenv("DATABASE_URL")),
+        timezone=os.getenv("DASHBOARD_TIMEZONE", "America/New_York"),
+        source_timezone=os.getenv("KEYSTROKE_TIMEZONE", "UTC"),
+    ).migrate()
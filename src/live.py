@@ -0,0 +1,141 @@
+import json
+import queue
+import threading
+import time
+
+import pandas as pd
+
+from src.constants import TIME_MAP
+
+
+class LiveActivity:
+    """
+    Server-sent event feed of the current activity and flow. A single poller thread per worker
+    asks Toggl for the current entry every `poll_interval` seconds on behalf of every connected
+    client, and a new state is only computed and pushed when that entry changes. Each state is
+    stamped with `asOf`, clients add the time elapsed since then to `flow` themselves. The poller
+    stops when the last client disconnects and starts again with the next one.
+    The finished entries of the week are cached and only reloaded when the current entry changes
+    (the previous one just finished) or after `tail_ttl` seconds, so a state costs one Toggl call
+    plus grouping a week of entries.
+    Every connected client holds a server thread for as long as it stays, so at most
+    `max_subscribers` are accepted per worker, the other threads stay free for the other routes.
+    """
+
+    def __init__(
+        self,
+        loader,
+        analyzer,
+        timezone="America/New_York",
+        poll_interval=10,
+        keepalive=15,
+        tail_ttl=300,
+        max_subscribers=8,
+    ):
+        self.loader = loader
+        self.analyzer = analyzer
+        self.timezone = timezone
+        self.poll_interval = poll_interval
+        self.keepalive = keepalive
+        self.tail_ttl = tail_ttl
+        self.max_subscribers = max_subscribers
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.state = None
+        self.entry = None
+        self.thread = None
+        self.tail_lock = threading.Lock()
+        self.tail = None
+        self.tail_key = None
+        self.tail_loaded_at = 0.0
+
+    def current(self):
+        """State of the current entry, computed on demand"""
+        return self._compute(self.loader.get_toggl_current_task(timezone=self.timezone))
+
+    def stream(self, subscriber):
+        """
+        Generator of the SSE messages of one client, the latest state is sent right away
+        :param subscriber: queue returned by `subscribe`
+        """
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    state = subscriber.get(timeout=self.keepalive)
+                except queue.Empty:
+                    ## Comment lines keep proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: activity\ndata: {json.dumps(state)}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def subscribe(self):
+        """:return: the queue the states of a new client are put in, None when the worker is full"""
+        subscriber = queue.Queue()
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            self.subscribers.add(subscriber)
+            if self.state is not None:
+                subscriber.put(self.state)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="live-activity", daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    self.entry = None
+                    return
+            try:
+                current_task = self.loader.get_toggl_current_task(timezone=self.timezone)
+                entry = tuple(current_task.iloc[0][["Id", "Project", "Start"]])
+                if entry != self.entry:
+                    state = self._compute(current_task)
+                    with self.lock:
+                        self.entry, self.state = entry, state
+                        for subscriber in self.subscribers:
+                            subscriber.put(state)
+            except Exception as error:
+                print("live activity poll failed:", error)
+            time.sleep(self.poll_interval)
+
+    def _compute(self, current_task):
+        """Flow and current activity of the week's entries plus the current task, like /metrics"""
+        master_df = pd.concat([self._tail(current_task), current_task]).reset_index(drop=True)
+        flow_df = self.analyzer.group_df(master_df)
+        real_df = self.analyzer.simple_group_df(master_df)
+        current_activity = current_task.iloc[0]["Project"]
+        return {
+            "neutralActivity": current_activity in self.analyzer.neutral,
+            "currentActivity": TIME_MAP[current_activity],
+            "currentActivityStartTime": real_df.iloc[-1]["Start"].isoformat(),
+            "flow": round(flow_df.iloc[-1]["SecDuration"] / 3600, 3),
+            "asOf": current_task.iloc[0]["End"].isoformat(),
+        }
+
+    def _tail(self, current_task):
+        """Finished entries of the last seven days"""
+        now = pd.Timestamp.now(tz=self.timezone)
+        key = (current_task.iloc[0]["Id"], str(now)[:10])
+        with self.tail_lock:
+            if (
+                self.tail is None
+                or key != self.tail_key
+                or time.monotonic() - self.tail_loaded_at > self.tail_ttl
+            ):
+                self.tail = self.loader.fetch_data(
+                    str(now - pd.Timedelta(days=6))[:10], str(now)[:10], timezone=self.timezone
+                )
+                self.tail_key = key
+                self.tail_loaded_at = time.monotonic()
+            return self.tail
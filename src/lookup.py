@@ -0,0 +1,45 @@
+import threading
+import time
+
+
+class LookupCache:
+    """
+    Id -> name map (projects, tags) fetched from Toggl and shared by every request of the worker.
+    The map is reused until it is older than `ttl` seconds or `invalidate` is called. An id that
+    is not in the map triggers a refresh on demand, at most once every `miss_interval` seconds so
+    a stale id can't turn every lookup into a round-trip.
+    """
+
+    def __init__(self, fetch, ttl=3600, miss_interval=60):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.miss_interval = miss_interval
+        self.lock = threading.Lock()
+        self.mapping = None
+        self.fetched_at = 0.0
+
+    def get(self, key, default=None):
+        return self.get_many([key], default)[0]
+
+    def get_many(self, keys, default=None):
+        with self.lock:
+            now = time.monotonic()
+            if self.mapping is None or now - self.fetched_at > self.ttl:
+                self._refresh(now)
+            elif now - self.fetched_at > self.miss_interval and any(
+                key is not None and key not in self.mapping for key in keys
+            ):
+                self._refresh(now)
+            return [self.mapping.get(key, default) for key in keys]
+
+    def warm(self):
+        """Fetches the map now if it is missing or expired"""
+        self.get_many([])
+
+    def invalidate(self):
+        with self.lock:
+            self.mapping = None
+
+    def _refresh(self, now):
+        self.mapping = self.fetch()
+        self.fetched_at = now
@@ -0,0 +1,243 @@
+import pandas as pd
+import pytz
+
+from src.timings import StageTimer
+
+# Metrics holding one value per day that are derived from the Toggl entries, closed days of these
+# are read from the rollup. Unplanned time and distraction counts come from the calendar and the
+# keystrokes, which Toggl syncs don't invalidate, so they are computed for the whole range
+DAILY_METRICS = [
+    "totalFlowList",
+    "productiveFlowList",
+    "n1HUTList",
+    "nw1HUTList",
+    "w1HUTList",
+    "unproductiveList",
+    "hoursFreeList",
+    "efficiencyList",
+    "productiveList",
+    "inefficiencyList",
+]
+# Start (ISO) and seconds of the last run that started on a day, stored with the day so the
+# current run is known when no entry after it is computed
+LAST_RUN_METRICS = ["lastRunStart", "lastRunSeconds"]
+
+
+class MetricsPipeline:
+    """
+    Computes the dashboard metrics of one date range. Every external call is issued on the
+    executor at once, the entries are loaded and grouped a single time, and flow, 1HUT,
+    efficiency and the current activity are all read from the same intermediate frames.
+    Days that already closed are read from the loader's rollup, only the days from the first
+    one that isn't materialized up to the end of the range are computed, and the closed ones
+    among them are written back.
+    After `run`, `master_df` holds the computed entries, `flow_df` their grouped runs,
+    `last_run_start` the start of the latest run (None without any entry), `current_activity`
+    the project of the current Toggl task and `timer` the duration of every stage.
+    """
+
+    def __init__(self, loader, analyzer, executor, timezone="America/New_York"):
+        self.loader = loader
+        self.analyzer = analyzer
+        self.executor = executor
+        self.timezone = timezone
+        self.timer = StageTimer()
+
+    def run(self, start_date, end_date, include_current=False, task_pile=None, historical=False):
+        """
+        :param start_date: first day of the range, "YYYY-MM-DD"
+        :param end_date: last day of the range (inclusive), "YYYY-MM-DD"
+        :param include_current: append the running Toggl task to the entries of the range
+        :param task_pile: TaskPileRefresher to read the task pile of the upcoming weeks from
+        :param historical: the range is in the past, so there is no ongoing flow
+        :return: dict of the metrics shared by the dashboard endpoints
+        """
+        l, timer = self.loader, self.timer
+        days = [str(day)[:10] for day in pd.date_range(start_date, end_date)]
+        today = str(pd.Timestamp.now(tz=self.timezone))[:10]
+        # The day before the range is loaded too, so a run crossing into the range is counted on
+        # the day it started like it is in any longer range. A closed range loads the day after
+        # it as well, so a run crossing its end is complete before its day is stored
+        lead_in = str(pd.Timestamp(start_date) - pd.Timedelta(days=1))[:10]
+        load_end = min(str(pd.Timestamp(end_date) + pd.Timedelta(days=1))[:10], today)
+        load_end = max(load_end, end_date)
+
+        ## The external calls that don't depend on the rollup start first
+        futures = self._submit(start_date, end_date)
+        ## Syncing before the rollup is read, the sync drops the stored days its edits touch
+        with timer.stage("sync"):
+            l.sync(lead_in, load_end, self.timezone)
+        stored = l.rollup.get(self.timezone, [day for day in days if day < today])
+        ## The last day is always computed, flow and the current activity are read from it
+        live_start = next((day for day in days if day not in stored), days[-1])
+
+        metrics = self._compute(
+            futures, live_start, end_date, load_end, include_current, task_pile, historical
+        )
+        self._materialize(metrics, [day for day in days if live_start <= day < today])
+
+        ## Without runs in the computed days, the latest one is the last stored
+        if self.last_run_start is None:
+            last_runs = [
+                stored[day]
+                for day in reversed(days)
+                if day < live_start and "lastRunStart" in stored[day]
+            ]
+            if last_runs:
+                self.last_run_start = last_runs[0]["lastRunStart"]
+                if not historical:
+                    metrics["flow"] = round(last_runs[0]["lastRunSeconds"] / 3600, 3)
+
+        for key in DAILY_METRICS:
+            earlier = {
+                day: stored[day][key]
+                for day in days
+                if day < live_start and key in stored[day]
+            }
+            metrics[key] = {**earlier, **metrics[key]}
+        metrics.update({"startDate": start_date, "endDate": end_date})
+        return metrics
+
+    def _submit(self, start_date, end_date):
+        """Issues the Toggl, calendar and keystroke calls that don't depend on the rollup"""
+        l, a, executor, timer = self.loader, self.analyzer, self.executor, self.timer
+        executor.submit(l.projects.warm)
+        executor.submit(l.tags.warm)
+        return {
+            "current_task": executor.submit(
+                timer.wrap("get_toggl_current_task", l.get_toggl_current_task),
+                timezone=self.timezone,
+            ),
+            "unplanned_time": executor.submit(
+                timer.wrap("calculate_unplanned_time", a.calculate_unplanned_time),
+                start_date,
+                end_date,
+                week=True,
+            ),
+            "distraction_counts": executor.submit(
+                timer.wrap("calculate_distraction_counts", a.calculate_distraction_counts),
+                start_date,
+                end_date,
+                week=True,
+                timezone=self.timezone,
+            ),
+        }
+
+    def _compute(
+        self, futures, start_date, end_date, load_end, include_current, task_pile, historical
+    ):
+        """
+        :param futures: the calls issued by _submit
+        :param start_date: first day the Toggl entries are computed for
+        :param load_end: last day the entries are loaded for, the day after `end_date` for a
+        closed range
+        """
+        l, a, executor, timer = self.loader, self.analyzer, self.executor, self.timer
+        lead_in = str(pd.Timestamp(start_date) - pd.Timedelta(days=1))[:10]
+        time_df_future = executor.submit(
+            timer.wrap("fetch_data", l.fetch_data),
+            lead_in,
+            load_end,
+            timezone=self.timezone,
+            sync=False,
+        )
+        current_task_future = futures["current_task"]
+        unplanned_time_future = futures["unplanned_time"]
+        distraction_counts_future = futures["distraction_counts"]
+
+        self.current_task = current_task_future.result()
+        self.current_activity = (
+            self.current_task.iloc[0]["Project"]
+            if not self.current_task.empty
+            else "No Activity"
+        )
+        time_df = time_df_future.result()
+        if include_current:
+            self.master_df = pd.concat([time_df, self.current_task]).reset_index(drop=True)
+        else:
+            self.master_df = time_df.reset_index(drop=True)
+
+        ## Grouping once, flow and 1HUT both read the grouped runs
+        with timer.stage("group_df"):
+            self.flow_df = a.group_df(self.master_df)
+        ## Entries after the range were only loaded to complete the runs crossing its end
+        after_end = pd.Timestamp(end_date, tz=self.timezone) + pd.DateOffset(days=1)
+        self.master_df = self.master_df[self.master_df["Start"] < after_end].reset_index(
+            drop=True
+        )
+        self.flow_df = self.flow_df[self.flow_df["Start"] < after_end].reset_index(drop=True)
+        flow, self.last_run_start = 0, None
+        if not self.flow_df.empty:
+            last_run = self.flow_df.iloc[-1]
+            self.last_run_start = last_run["Start"].isoformat()
+            if not historical:
+                flow = round(last_run["SecDuration"] / 3600, 3)
+        first_day = pd.Timestamp(start_date, tz=self.timezone)
+        entries = self.master_df[self.master_df["Start"] >= first_day].reset_index(drop=True)
+        runs = self.flow_df[self.flow_df["Start"] >= first_day].reset_index(drop=True)
+        # day -> the last run that started on it
+        self.last_runs = {
+            str(run.Start)[:10]: {
+                "lastRunStart": run.Start.isoformat(),
+                "lastRunSeconds": int(run.SecDuration),
+            }
+            for run in runs.itertuples(index=False)
+        }
+        with timer.stage("calculate_1HUT"):
+            p1HUT, n1HUT, nw1HUT, w1HUT = a.calculate_1HUT(
+                entries, week=True, grouped_df=runs
+            ).values()
+        with timer.stage("efficiency"):
+            hours_free, efficiency, inefficiency, productive, neutral, wasted, non_wasted = (
+                a.efficiency(l, entries, week=True).values()
+            )
+        oneHUT = {
+            date: round(
+                n1HUT.get(date, 0)
+                + nw1HUT.get(date, 0)
+                + p1HUT.get(date, 0)
+                + w1HUT.get(date, 0),
+                3,
+            )
+            for date in n1HUT
+        }
+
+        metrics = {
+            "unplannedTimeList": unplanned_time_future.result(),
+            "totalFlowList": oneHUT,
+            "productiveFlowList": p1HUT,
+            "n1HUTList": n1HUT,
+            "nw1HUTList": nw1HUT,
+            "w1HUTList": w1HUT,
+            "unproductiveList": wasted,
+            "hoursFreeList": hours_free,
+            "efficiencyList": efficiency,
+            "productiveList": productive,
+            "distractionCountList": distraction_counts_future.result(),
+            "inefficiencyList": inefficiency,
+            "flow": flow,
+        }
+        if task_pile is not None:
+            # Only costs the computation when the background thread has no value yet
+            with timer.stage("calculate_task_pile"):
+                metrics["taskPile"], age = task_pile.get()
+            metrics["taskPileAge"] = round(age)
+        return metrics
+
+    def _materialize(self, metrics, days):
+        """Writes the values of the given closed days to the rollup"""
+        zone = pytz.timezone(self.timezone)
+        self.loader.rollup.put(
+            self.timezone,
+            [
+                (
+                    day,
+                    *self.loader._day_bounds(day, day, zone),
+                    {
+                        **{key: metrics[key][day] for key in DAILY_METRICS if day in metrics[key]},
+                        **self.last_runs.get(day, {}),
+                    },
+                )
+                for day in days
+            ],
+        )
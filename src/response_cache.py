@@ -0,0 +1,59 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def etag(body, version):
+    """Strong ETag of a response body rendered from the given rollup version"""
+    return hashlib.sha256(f"{version}:{body}".encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Computed responses keyed by request parameters. Closed entries (ranges that ended before
+    today) stay until they are evicted as least recently used, their keys carry the rollup
+    version so an edit of their days is never served from an older entry. Live entries (ranges
+    that include today) expire after `live_ttl` seconds.
+    """
+
+    def __init__(self, max_entries=256, live_ttl=60):
+        self.max_entries = max_entries
+        self.live_ttl = live_ttl
+        self.lock = threading.Lock()
+        # key -> (value, expiry as time.monotonic() or None for closed entries)
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """:return: the stored value or None if the key is missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and time.monotonic() > expires_at:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, closed):
+        """:return: `value`"""
+        expires_at = None if closed else time.monotonic() + self.live_ttl
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, days):
+        """
+        Drops the entries of the ranges containing any of the given days
+        :param days: list of "YYYY-MM-DD", keys start with the first and last day of their range
+        """
+        with self.lock:
+            for key in list(self.entries):
+                start_date, end_date = key[:2]
+                if any(start_date <= day <= end_date for day in days):
+                    del self.entries[key]
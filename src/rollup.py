@@ -0,0 +1,135 @@
+import sqlite3
+from contextlib import closing
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_days (
+    timezone TEXT NOT NULL,
+    day TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    PRIMARY KEY (timezone, day)
+);
+CREATE TABLE IF NOT EXISTS metric_rollup (
+    timezone TEXT NOT NULL,
+    day TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value,
+    PRIMARY KEY (timezone, day, metric)
+);
+CREATE TABLE IF NOT EXISTS rollup_version (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO rollup_version (id, version) VALUES (0, 0);
+"""
+
+
+class MetricsRollup:
+    """
+    Materialized per-day metrics, one row per day per metric. A day is written once it has
+    closed, so a range of any length is assembled from its stored rows and only the days that
+    are still open (or were never computed) go through the pipeline. `rollup_days` records which
+    days are complete together with their UTC bounds, a metric missing for a complete day means
+    the day has no value for it. The value column has no type so ints and floats come back as
+    they were stored. `version` goes up whenever stored days are dropped or `bump_version` is
+    called, every worker sees it, so anything built from the stored days can be keyed on it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def version(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT version FROM rollup_version").fetchone()[0]
+
+    def bump_version(self):
+        """Moves the version on without dropping any day, for data computed outside the rollup"""
+        with closing(self._connect()) as conn, conn:
+            self._bump_version(conn)
+
+    def _bump_version(self, conn):
+        conn.execute("UPDATE rollup_version SET version = version + 1")
+
+    def get(self, timezone, days):
+        """
+        :param timezone: timezone the days were cut in
+        :param days: list of "YYYY-MM-DD"
+        :return: dict of day -> {metric: value} for the days that are materialized
+        """
+        if not days:
+            return {}
+        with closing(self._connect()) as conn:
+            complete = {
+                row[0]
+                for row in conn.execute(
+                    "SELECT day FROM rollup_days WHERE timezone = ? AND day BETWEEN ? AND ?",
+                    (timezone, min(days), max(days)),
+                )
+            }
+            rows = conn.execute(
+                "SELECT day, metric, value FROM metric_rollup "
+                "WHERE timezone = ? AND day BETWEEN ? AND ?",
+                (timezone, min(days), max(days)),
+            ).fetchall()
+        stored = {day: {} for day in days if day in complete}
+        for day, metric, value in rows:
+            if day in stored:
+                stored[day][metric] = value
+        return stored
+
+    def put(self, timezone, days):
+        """
+        :param days: list of (day, start, end, {metric: value}), start and end are the UTC unix
+        seconds bounding the day
+        """
+        with closing(self._connect()) as conn, conn:
+            for day, start, end, values in days:
+                conn.execute(
+                    "DELETE FROM metric_rollup WHERE timezone = ? AND day = ?",
+                    (timezone, day),
+                )
+                conn.executemany(
+                    "INSERT INTO metric_rollup (timezone, day, metric, value) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(timezone, day, metric, value) for metric, value in values.items()],
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO rollup_days (timezone, day, start, end) "
+                    "VALUES (?, ?, ?, ?)",
+                    (timezone, day, start, end),
+                )
+
+    def invalidate(self, times):
+        """
+        Drops the days within 25 hours of any of the given UTC unix seconds, so the days before
+        and after the edited one go as well. A run crossing midnight is counted on the day it started, so an edit can move
+        time out of the next day, and an edit after midnight changes a run of the day before.
+        """
+        with closing(self._connect()) as conn, conn:
+            dropped = 0
+            for time in set(times):
+                # 25 hours reaches the neighbouring days across a DST change
+                bounds = (time - 25 * 3600, time + 25 * 3600)
+                conn.execute(
+                    "DELETE FROM metric_rollup WHERE (timezone, day) IN ("
+                    "SELECT timezone, day FROM rollup_days WHERE end > ? AND start <= ?)",
+                    bounds,
+                )
+                dropped += conn.execute(
+                    "DELETE FROM rollup_days WHERE end > ? AND start <= ?", bounds
+                ).rowcount
+            if dropped:
+                self._bump_version(conn)
+
+    def clear(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM metric_rollup")
+            conn.execute("DELETE FROM rollup_days")
+            self._bump_version(conn)
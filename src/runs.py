@@ -0,0 +1,39 @@
+import numpy as np
+
+
+class Runs:
+    """
+    Run-length view over consecutive rows. `new_run` flags every row that starts a new run, and all
+    reductions are single numpy passes over the row arrays (`reduceat` on the run starts) instead
+    of a groupby or a per-group scan of the frame.
+    """
+
+    def __init__(self, new_run):
+        new_run = np.array(new_run, dtype=bool)
+        if len(new_run):
+            new_run[0] = True
+        self.length = len(new_run)
+        self.starts = np.flatnonzero(new_run)
+        self.sizes = np.diff(np.append(self.starts, self.length))
+        # Run number of every row, starting at 1 like a cumsum over the flags
+        self.labels = np.cumsum(new_run)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def first(self, values):
+        return np.asarray(values)[self.starts]
+
+    def sum(self, values):
+        return self._reduce(np.add, np.asarray(values))
+
+    def all(self, values):
+        return self._reduce(np.logical_and, np.asarray(values, dtype=bool))
+
+    def any(self, values):
+        return self._reduce(np.logical_or, np.asarray(values, dtype=bool))
+
+    def _reduce(self, ufunc, values):
+        if not len(self.starts):
+            return values[:0]
+        return ufunc.reduceat(values, self.starts)
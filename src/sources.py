@@ -0,0 +1,184 @@
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+SOURCE_MODES = ("live", "record", "replay")
+
+# Recomputed by requests or meaningless for a body that is already decoded
+DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+class Source:
+    """
+    Where the external calls (Toggl, Google Calendar, Postgres) are answered from.
+    `live` makes the calls. `record` makes them too and writes every response to a JSON fixture
+    under `fixtures`. `replay` answers from the fixtures only, after sleeping `latency`
+    milliseconds (or the recorded duration of the call when it is "recorded"), so the whole
+    /metrics path can be profiled without a network.
+    A call is looked up by its exact request first, then by its `route` (e.g. the method and
+    URL of an HTTP call, its latest recording), since some requests carry the current time.
+    """
+
+    def __init__(self, mode="live", fixtures="fixtures", latency=None):
+        """
+        :param latency: dict of kind ("toggl", "calendar", "postgres") -> milliseconds or
+        "recorded", kinds that are missing replay without delay
+        """
+        if mode not in SOURCE_MODES:
+            raise ValueError(f"SOURCE_MODE must be one of {SOURCE_MODES}, not {mode!r}")
+        self.mode = mode
+        self.fixtures = fixtures
+        self.latency = latency or {}
+
+    @classmethod
+    def from_env(cls):
+        latency = {}
+        for kind in ("toggl", "calendar", "postgres"):
+            value = os.getenv(f"REPLAY_LATENCY_{kind.upper()}", os.getenv("REPLAY_LATENCY", "0"))
+            latency[kind] = value if value == "recorded" else float(value)
+        return cls(
+            mode=os.getenv("SOURCE_MODE", "live"),
+            fixtures=os.getenv("SOURCE_FIXTURES", "fixtures"),
+            latency=latency,
+        )
+
+    def call(self, kind, request, live, route=None, missing=None):
+        """
+        :param kind: name of the external service, fixtures are kept in a directory per kind
+        :param request: JSON serializable description of the call, its fixture key
+        :param live: function making the call, returning a JSON serializable response
+        :param route: looser key, matched when no fixture has the exact `request`
+        :param missing: function of `request` answering replayed calls without a fixture,
+        LookupError is raised if there is none
+        """
+        if self.mode == "live":
+            return live()
+
+        if self.mode == "record":
+            started = time.perf_counter()
+            response = live()
+            entry = {
+                "request": request,
+                "response": response,
+                "duration": round((time.perf_counter() - started) * 1000, 3),
+            }
+            self._write(kind, request, entry)
+            if route is not None:
+                self._write(kind, route, entry)
+            return response
+
+        entry = self._read(kind, request)
+        if entry is None and route is not None:
+            entry = self._read(kind, route)
+        if entry is None:
+            if missing is not None:
+                return missing(request)
+            raise LookupError(f"no {kind} fixture for {json.dumps(request)}")
+
+        latency = self.latency.get(kind, 0)
+        latency = entry["duration"] if latency == "recorded" else latency
+        time.sleep(latency / 1000)
+        return entry["response"]
+
+    def _path(self, kind, key):
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.fixtures, kind, f"{digest}.json")
+
+    def _read(self, kind, key):
+        try:
+            with open(self._path(kind, key)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, kind, key, entry):
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        ## Written aside and renamed, concurrent recordings of a call never leave half a file
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(handle, "w") as file:
+            json.dump(entry, file, indent=2)
+        os.replace(temporary, path)
+
+
+class SourceAdapter(BaseAdapter):
+    """
+    Transport adapter sending the calls of a requests session through a Source. Recorded
+    responses keep their status, headers and body, and are read back into regular Responses
+    (streamed reads included).
+    """
+
+    def __init__(self, source, kind, adapter):
+        """:param adapter: adapter making the live calls"""
+        super().__init__()
+        self.source = source
+        self.kind = kind
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        ## The route keeps the names of the query parameters, not their values (`since` is the
+        ## current time), so /me/time_entries and /me/time_entries?since= stay apart
+        url = urlsplit(request.url)
+        names = sorted({name for name, _ in parse_qsl(url.query, keep_blank_values=True)})
+        recorded = self.source.call(
+            self.kind,
+            {"method": request.method, "url": request.url, "body": body.decode(errors="replace")},
+            lambda: self._send_live(request, **kwargs),
+            route={"method": request.method, "url": url._replace(query="&".join(names)).geturl()},
+        )
+        return self._response(request, recorded)
+
+    def close(self):
+        self.adapter.close()
+
+    def _send_live(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        try:
+            content = response.content
+            recorded = {
+                "status": response.status_code,
+                "reason": response.reason,
+                "headers": {
+                    name: value
+                    for name, value in response.headers.items()
+                    if name.lower() not in DROPPED_HEADERS
+                },
+            }
+        finally:
+            ## Returns the connection to the pool
+            response.close()
+        try:
+            recorded["text"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            recorded["base64"] = base64.b64encode(content).decode()
+        return recorded
+
+    @staticmethod
+    def _response(request, recorded):
+        if "text" in recorded:
+            content = recorded["text"].encode("utf-8")
+        else:
+            content = base64.b64decode(recorded["base64"])
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response.reason = recorded.get("reason")
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        ## The whole body is already read, iter_content slices it like a streamed one
+        response._content = content
+        response._content_consumed = True
+        return response
@@ -0,0 +1,161 @@
+import json
+import sqlite3
+import threading
+from contextlib import closing
+
+import numpy as np
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS time_entries (
+    id INTEGER PRIMARY KEY,
+    project_id INTEGER,
+    description TEXT,
+    tag_ids TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    stop INTEGER NOT NULL,
+    at INTEGER
+);
+CREATE INDEX IF NOT EXISTS time_entries_start ON time_entries (start);
+CREATE TABLE IF NOT EXISTS synced_days (day TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class TimeEntryStore:
+    """
+    Local SQLite copy of the Toggl time entries. Start, stop and modification times are kept as
+    UTC unix seconds so that any range can be cut out in the dashboard timezone. The days that
+    were already downloaded are remembered in `synced_days`, and `sync_state` holds the time of
+    the last delta sync so only entries modified after it have to be fetched again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Serialises syncs inside a worker, SQLite handles locking between workers
+        self.lock = threading.RLock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_state(self, key):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT value FROM sync_state WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key, value):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+                (key, str(value)),
+            )
+
+    def missing_days(self, days):
+        with closing(self._connect()) as conn:
+            synced = {row[0] for row in conn.execute("SELECT day FROM synced_days")}
+        return [day for day in days if day not in synced]
+
+    def mark_synced(self, days):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO synced_days (day) VALUES (?)",
+                [(day,) for day in days],
+            )
+
+    def forget_days(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM synced_days")
+
+    def delete_range(self, start, end):
+        """
+        Deletes every stored entry starting in [start, end) before the range is downloaded
+        again, so entries that were deleted in Toggl since then disappear as well.
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "DELETE FROM time_entries WHERE start >= ? AND start < ?", (start, end)
+            )
+
+    def upsert(self, entries):
+        with closing(self._connect()) as conn, conn:
+            self._upsert(conn, entries)
+
+    def delete(self, ids):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "DELETE FROM time_entries WHERE id = ?", [(id_,) for id_ in ids]
+            )
+
+    def starts(self, ids):
+        """:return: start times of the stored entries with the given ids"""
+        with closing(self._connect()) as conn:
+            return [
+                row[0]
+                for id_ in ids
+                for row in conn.execute(
+                    "SELECT start FROM time_entries WHERE id = ?", (id_,)
+                )
+            ]
+
+    def entries_between(self, start, end):
+        """
+        Reads the entries row by row into column arrays allocated for the row count up front, so
+        no intermediate list of rows is built.
+        :param start: UTC unix seconds, inclusive
+        :param end: UTC unix seconds, exclusive
+        :return: dict of id, project_id, description, tag_ids, start and stop arrays ordered by
+        start
+        """
+        with closing(self._connect()) as conn:
+            # The count and the rows are read from the same snapshot
+            conn.execute("BEGIN")
+            count = conn.execute(
+                "SELECT COUNT(*) FROM time_entries WHERE start >= ? AND start < ?",
+                (start, end),
+            ).fetchone()[0]
+            columns = {
+                "id": np.empty(count, dtype=np.int64),
+                "project_id": np.empty(count, dtype=object),
+                "description": np.empty(count, dtype=object),
+                "tag_ids": np.empty(count, dtype=object),
+                "start": np.empty(count, dtype=np.int64),
+                "stop": np.empty(count, dtype=np.int64),
+            }
+            rows = conn.execute(
+                "SELECT id, project_id, description, tag_ids, start, stop FROM time_entries "
+                "WHERE start >= ? AND start < ? ORDER BY start, id LIMIT ?",
+                (start, end, count),
+            )
+            for i, (id_, project_id, description, tag_ids, start, stop) in enumerate(rows):
+                columns["id"][i] = id_
+                columns["project_id"][i] = project_id
+                columns["description"][i] = description
+                columns["tag_ids"][i] = json.loads(tag_ids)
+                columns["start"][i] = start
+                columns["stop"][i] = stop
+        return columns
+
+    @staticmethod
+    def _upsert(conn, entries):
+        conn.executemany(
+            "INSERT OR REPLACE INTO time_entries "
+            "(id, project_id, description, tag_ids, start, stop, at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    entry["id"],
+                    entry["project_id"],
+                    entry["description"],
+                    json.dumps(entry["tag_ids"] or []),
+                    entry["start"],
+                    entry["stop"],
+                    entry["at"],
+                )
+                for entry in entries
+            ),
+        )
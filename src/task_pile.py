@@ -0,0 +1,75 @@
+import threading
+import time
+
+
+class TaskPileRefresher:
+    """
+    Keeps the task pile (hours planned over the upcoming weeks) precomputed off the request path.
+    A background thread syncs the calendars every `poll_interval` seconds and recomputes the pile
+    when one of them changed, or every `interval` seconds since the window moves with the clock.
+    Requests only read the last value and its age.
+    """
+
+    def __init__(self, analyzer, interval=300, poll_interval=60, histograms=None):
+        """
+        :param histograms: StageHistograms the durations of the background computations are
+        observed in, as stage "calculate_task_pile_background"
+        """
+        self.analyzer = analyzer
+        self.histograms = histograms
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.value = None
+        self.computed_at = None
+        self.versions = None
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+    def start(self):
+        """Starts the background thread, once per process (calls after the first do nothing)"""
+        with self.thread_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="task-pile", daemon=True)
+                self.thread.start()
+
+    def get(self):
+        """
+        :return: (task pile in hours, age of the value in seconds), the first call computes the
+        value if the background thread hasn't yet
+        """
+        with self.lock:
+            if self.value is None:
+                self._refresh()
+            return self.value, time.time() - self.computed_at
+
+    def _run(self):
+        while True:
+            try:
+                for cache in self.analyzer.event_caches.values():
+                    cache.sync()
+                versions = self._versions()
+                with self.lock:
+                    if (
+                        self.value is None
+                        or versions != self.versions
+                        or time.time() - self.computed_at > self.interval
+                    ):
+                        self._refresh()
+            except Exception as error:
+                print("task pile refresh failed:", error)
+            time.sleep(self.poll_interval)
+
+    def _refresh(self):
+        versions = self._versions()
+        started = time.perf_counter()
+        self.value = self.analyzer.calculate_task_pile()
+        if self.histograms is not None and threading.current_thread() is self.thread:
+            self.histograms.observe(
+                "calculate_task_pile_background", time.perf_counter() - started
+            )
+        self.computed_at = time.time()
+        self.versions = versions
+
+    def _versions(self):
+        return {name: cache.version for name, cache in self.analyzer.event_caches.items()}
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the histogram buckets, from a warm cache read to a slow Toggl report
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class StageTimer:
+    """
+    Durations of the stages of one request. Stages may run on executor threads, each one is
+    recorded once under its own name.
+    """
+
+    def __init__(self):
+        self.durations = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = time.perf_counter() - started
+
+    def wrap(self, name, function):
+        """:return: `function`, timed as stage `name` when called (e.g. on the executor)"""
+
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+
+        return timed
+
+    def header(self):
+        """Value of the Server-Timing response header, durations in milliseconds"""
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.durations.items()
+        )
+
+
+class StageHistograms:
+    """
+    Histograms of the stage durations, rendered in the Prometheus text format. Every worker keeps
+    its own, the series carry a `worker` label (the pid) so they can be summed across workers.
+    """
+
+    def __init__(self, name="dashboard_stage_duration_seconds", buckets=BUCKETS):
+        self.name = name
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # stage -> [count per bucket (the last one is +Inf), sum]
+        self.stages = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            entry = self.stages.setdefault(stage, [[0] * (len(self.buckets) + 1), 0.0])
+            index = next(
+                (i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets)
+            )
+            entry[0][index] += 1
+            entry[1] += seconds
+
+    def observe_timer(self, timer):
+        for stage, seconds in timer.durations.items():
+            self.observe(stage, seconds)
+
+    def render(self):
+        worker = os.getpid()
+        lines = [
+            f"# HELP {self.name} Duration of the stages of the dashboard requests.",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            stages = {stage: (list(counts), total) for stage, (counts, total) in self.stages.items()}
+
+        for stage, (counts, total) in sorted(stages.items()):
+            labels = f'stage="{stage}",worker="{worker}"'
+            ## Prometheus buckets are cumulative
+            cumulative = 0
+            for bound, count in zip([*map(str, self.buckets), "+Inf"], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return "\n".join(lines) + "\n"